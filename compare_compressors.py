@@ -13,13 +13,28 @@ Tests various HTTP header compression algorithms, to compare them.
 # pylint: disable=W0311
 
 from collections import defaultdict
+from functools import partial
 from importlib import import_module
+import copy
+import gc
+import hashlib
 import locale
+import multiprocessing
 import optparse
+import re
 import sys
 import os.path
 
+import compressor
+from compressor import cookie_crumbs, prepare, stripped_headers
+import corpus
 import harfile
+from profiling import CodecProfiler
+from resultcache import ResultCache
+from sampling import Deduplicator, StratifiedSample
+from stats import QuantileSketch, RunningStats, cpu_affinity, pin_to_cpu, \
+  timed, wall_clock
+import synthetic
 
 locale.setlocale(locale.LC_ALL, 'en_US')
 
@@ -28,70 +43,511 @@ class CompressionTester(object):
   This is the thing.
   """
   msg_types = ['req', 'res']
+  sample_interval = 0.001  # seconds of CPU time between --flamegraph samples
+  timing_header = '%9s %7s %7s %7s %7s %7s' % (
+    'msg/s', 'MB/s', 'cpu us', 'p50 us', 'p95 us', 'p99 us')
   
-  def __init__(self):
+  def __init__(self, options=None, args=None):
     self.output = sys.stdout.write
+    self.error = sys.stderr.write
     self.warned = {'http1_gzip': True}  # procs with no decompress support
-    self.tsv_out = defaultdict(list)  # accumulator for TSV output
+    self.tsv_out = {}  # message_type -> [TSV file, row count]
     self.ttls = None
-    self.lname = 0  # longest processor name
-    self.options, self.args = self.parse_options()
-    self.codec_processors = self.get_compressors()
-    self.run()
+    if options is None:
+      self.options, self.args = self.parse_options()
+    else:
+      self.options, self.args = options, args
+    self.specs = self.codec_specs()  # [(name, module_name, params), ...]
+    self.lname = max([len(name) for name, _, _ in self.specs])
+    self.codec_processors = {}
+    self.forms = set()  # derived forms that the processors made so far use
+    for name, module_name, _ in self.specs:
+      if module_name in self.warned:
+        self.warned[name] = True
+    self.verify_mode, _, every = self.options.verify.partition(':')
+    self.verify_every = int(every or 1)
+    self.verify_counts = defaultdict(int)  # (name, message_type) -> count
+    self.verifiers = {}  # (name, message_type) -> background verifier
+    self.cache = None
+    self.codec_versions = {}  # (module_name, params) -> codec_version()
+    if self.options.cache_dir:
+      self.cache = ResultCache(self.options.cache_dir,
+                               max_age=self.options.cache_max_age * 86400,
+                               max_size=self.options.cache_max_size * 2 ** 20)
+    self.failed = set()  # names of codecs with compression errors
+    self.profiler = None
+    if self.options.profile:
+      self.profiler = CodecProfiler(
+        self.options.flamegraph and self.sample_interval or None)
+    self.cached = defaultdict(list)  # name -> cache entries stored
+    self.deduplicator = self.options.dedup and Deduplicator() or None
+    self.sample = None
+    if self.options.sample:
+      self.sample = StratifiedSample(self.options.sample,
+                                     self.options.sample_seed)
 
       
   def run(self):
     "Let's do this thing."
-    messages = []
-    for filename in self.args:
-      har_requests, har_responses = harfile.read_har_file(filename)
-      both = zip(har_requests, har_responses)
-      for req, res in both:
-        messages.append(('req', req, req[':host']))
-        messages.append(('res', res, req[':host']))
-    self.ttls = self.process_messages(messages)
+    if self.options.bench:
+      self.run_bench()
+      return
+    if self.options.sweep or self.options.jobs > 1:
+      if self.verify_mode == 'async':
+        self.error("WARNING: --verify=async doesn't work with --jobs or "
+                   "--sweep; verifying inline.\n")
+        self.verify_mode = 'all'
+      if self.options.read_jobs > 1:
+        self.error("WARNING: --read-jobs doesn't work with --jobs or "
+                   "--sweep; each worker reads its own files.\n")
+    if self.options.sweep:
+      self.ttls = self.process_messages(self.sweep_results(self.args))
+    elif self.options.jobs > 1:
+      self.ttls = self.process_shards(self.args)
+    else:
+      self.ttls = self.process_messages(self.iter_results(self.args))
     for msg_type in self.msg_types:
       self.print_results(self.ttls.get(msg_type, {}), msg_type, True)
+      if self.sample:
+        self.print_sample(msg_type)
+    if not self.options.sweep and self.options.jobs <= 1:
+      self.print_reports()
+    if self.deduplicator:
+      self.error("Dropped %i duplicate messages.\n" %
+                 self.deduplicator.duplicates)
     if self.options.tsv:
       self.output_tsv()
+    if self.cache:
+      self.cache.evict()
+    if self.profiler:
+      self.profiler.stop()
+      paths = self.profiler.write(self.options.profile)
+      self.error("Wrote %i profile files to %s.\n" % (
+        len(paths), self.options.profile))
       
     
+  def run_bench(self):
+    """
+    Replay the messages in the HAR files through fresh processors for each
+    codec several times, timing compression and decompression on their own.
+    Reports the median and spread of throughput after discarding warmups.
+
+    The messages are held in a compact Corpus, and only those of the type
+    being replayed are prepared for the codecs.
+    """
+    self.pin_cpu()
+    har_corpus = corpus.Corpus()
+    for message_type, items, host in self.iter_items(self.args):
+      har_corpus.add(message_type, items, host)
+    warmup, reps = self.options.bench_warmup, self.options.bench_reps
+    rates = defaultdict(list)  # (msg_type, direction, name) -> [rates, ...]
+    counts = {}  # msg_type -> number of messages
+    for msg_type in self.msg_types:
+      messages = [(prepare(message, self.forms), host)
+                  for message_type, message, host in har_corpus
+                  if message_type == msg_type]
+      counts[msg_type] = len(messages)
+      insize = sum([self.message_size(message) for message, _ in messages])
+      for rep in range(warmup + reps):
+        for name, module_name, params in self.specs:
+          processor = self.make_processors(module_name, params)[
+            self.msg_types.index(msg_type)]
+          for message, _ in messages:
+            prepare(message, processor.forms)
+          timings = self.bench_processor(processor, messages,
+                                         self.options.batch)
+          if rep < warmup:
+            continue
+          for direction, wall in zip(['compress', 'decompress'], timings):
+            if wall:
+              rates[(msg_type, direction, name)].append((
+                len(messages) / wall, insize / wall / 2 ** 20))
+      del messages
+
+    names = sorted(set([name for name, _, _ in self.specs]))
+    for msg_type in self.msg_types:
+      self.output("%i %s messages, %i runs after %i warmup\n" % (
+        counts[msg_type], msg_type, reps, warmup))
+      for direction in ['compress', 'decompress']:
+        self.output('%%%ds %%17s | %%9s %%7s %%7s %%7s %%7s\n' % self.lname % (
+          '', direction + 'ion', 'msg/s', 'MB/s', 'min', 'max', 'spread'))
+        fmt = '%%s %%%ds %%13s | %%9.0f %%7.2f %%7.2f %%7.2f %%6.1f%%%%\n' % \
+          self.lname
+        for name in names:
+          runs = rates.get((msg_type, direction, name))
+          if not runs:
+            continue
+          mb_rates = [mb_rate for _, mb_rate in runs]
+          mb_median = median(mb_rates)
+          self.output(fmt % (
+            msg_type, name, '', median([msg_rate for msg_rate, _ in runs]),
+            mb_median, min(mb_rates), max(mb_rates),
+            100.0 * (max(mb_rates) - min(mb_rates)) / mb_median
+          ))
+      self.output("\n")
+
+
+  @staticmethod
+  def bench_processor(processor, messages, batch=1):
+    """
+    Compress messages with processor (batch at a time, if more than one)
+    and then decompress the results, with the garbage collector off.
+    Returns the wall-clock time each took; the decompression time is None
+    if the processor can't decompress.
+    """
+    gc.collect()
+    gc.disable()
+    try:
+      start = wall_clock()
+      if batch > 1:
+        compressed = []
+        for index in xrange(0, len(messages), batch):
+          compressed.extend(
+            processor.compress_batch(messages[index:index + batch]))
+      else:
+        compressed = [processor.compress(message, host)
+                      for message, host in messages]
+      compress_wall = wall_clock() - start
+      try:
+        start = wall_clock()
+        for blob in compressed:
+          processor.decompress(blob)
+        decompress_wall = wall_clock() - start
+      except NotImplementedError:
+        decompress_wall = None
+    finally:
+      gc.enable()
+    return compress_wall, decompress_wall
+
+
+  def pin_cpu(self):
+    """
+    Pin this process (and so, codec child processes) to the CPU given by
+    --cpu, or else the last one it may run on, to reduce timing noise.
+    """
+    cpu = self.options.cpu
+    try:
+      if cpu is None:
+        cpu = max(cpu_affinity() or [0])
+      pin_to_cpu(cpu)
+    except OSError as oops:
+      self.error("WARNING: can't pin to CPU %i (%s); timings may be "
+                 "noisy.\n" % (cpu, oops.strerror))
+
+
+  def iter_messages(self, filenames):
+    "Generate (message_type, message, host) tuples from HAR or corpus files."
+    for message_type, items, host in self.iter_items(filenames):
+      yield message_type, dict(items), host
+
+
+  def iter_items(self, filenames):
+    """
+    Generate (message_type, header items, host) tuples from HAR or corpus
+    files, or with --interleave, from HAR files merged in time order, or
+    with --synthetic, from a model learned from the files; then drop
+    duplicates with --dedup, and sample them with --sample.
+    """
+    if self.options.synthetic:
+      model = synthetic.HeaderModel()
+      model.learn_files(filenames, self.options.read_jobs, self.har_reader())
+      items = model.generate(self.options.synthetic,
+                             self.options.synthetic_seed)
+    elif self.options.interleave:
+      items = corpus.iter_entry_items(
+        harfile.iter_interleaved_items(filenames))
+    else:
+      items = corpus.iter_items(filenames, self.options.read_jobs,
+                                self.har_reader())
+    if self.deduplicator:
+      items = self.deduplicator.unique(items)
+    if self.sample:
+      messages = corpus.Corpus()
+      for message_type, message_items, host in items:
+        messages.add(message_type, message_items, host)
+      items = self.sample.select(messages)
+    return items
+
+
+  def har_reader(self):
+    "Return the function to read HAR files with, for harfile."
+    har_cache = self.options.har_cache
+    if har_cache:
+      return partial(harfile.iter_cached_har_items,
+                     cache_dir=har_cache != 'next' and har_cache or None)
+    return harfile.iter_input_items
+
+
+  def iter_results(self, filenames):
+    """
+    Generate the results of processing each message in the HAR files, in
+    the format returned by process_message().
+
+    With a --cache-dir, each file is processed with fresh codec state, and
+    cached results are used for the codecs that already have them.
+    """
+    if self.cache:
+      for filename in filenames:
+        for results in self.file_results(filename):
+          yield results
+      return
+    self.codec_processors = self.get_compressors()
+    for results in self.iter_processed(self.iter_messages(filenames)):
+      yield results
+
+
+  def file_results(self, filename):
+    """
+    Generate the results of processing each message in a HAR file with
+    fresh codec state, loading and storing them in the result cache.
+    """
+    digest = harfile.file_digest(filename)
+    cached = {}
+    fresh = []
+    for name, module_name, params in self.specs:
+      entry = self.cache.load(digest, module_name, params,
+                              self.codec_version(module_name, params))
+      if entry is None:
+        fresh.append((name, module_name, params))
+        continue
+      cached[name], flags = entry
+      if flags & ResultCache.UNCHECKED:
+        self.warn_unchecked(name)
+
+    if fresh:
+      self.codec_processors = dict([
+        (name, self.make_processors(module_name, params))
+        for name, module_name, params in fresh])
+      for verifier in self.verifiers.values():
+        verifier.reset()
+      self.failed.clear()
+      new_records = defaultdict(list)
+      processed = self.iter_processed(self.iter_messages([filename]))
+    else:
+      num = min([len(records) for records in cached.values()])
+      processed = [{"_message_type": self.msg_types[records[0]]}
+                   for records in cached[cached.keys()[0]][:num]]
+
+    for index, results in enumerate(processed):
+      for name, _, _ in fresh:
+        new_records[name].append(self.cache_record(results, name))
+      for name, records in cached.items():
+        self.add_record(results, name, records[index])
+      yield results
+
+    for name, module_name, params in fresh:
+      if name not in self.failed:
+        self.cached[name].append(self.cache.store(
+          digest, module_name, params,
+          self.codec_version(module_name, params), new_records[name],
+          name in self.warned and ResultCache.UNCHECKED or 0))
+
+
+  def codec_version(self, module_name, params):
+    """
+    Return a digest of a codec's source, for the result cache: that of its
+    module's files, the compressor package's own (e.g., shared forms) and
+    any file a parameter names (e.g., the fork codec's program).
+    """
+    key = (module_name, tuple(params))
+    if key not in self.codec_versions:
+      package = os.path.dirname(os.path.abspath(compressor.__file__))
+      paths = [os.path.join(package, '__init__.py')]
+      for dirpath, dirnames, filenames in os.walk(
+          os.path.join(package, module_name)):
+        dirnames.sort()
+        paths.extend([os.path.join(dirpath, filename)
+                      for filename in sorted(filenames)
+                      if not filename.endswith(('.pyc', '.pyo'))])
+      paths.extend([param for param in params if os.path.isfile(param)])
+      self.codec_versions[key] = hashlib.sha1(
+        ''.join([harfile.file_digest(path) for path in paths])).hexdigest()
+    return self.codec_versions[key]
+
+
+  def cache_record(self, results, name):
+    "Return the result cache record for codec name in results."
+    result = results[name]
+    decompress = result['decompress'] or {'wall': -1, 'cpu': -1}
+    return (self.msg_types.index(results["_message_type"]), result['size'],
+            results["_insize"], result['compress']['wall'],
+            result['compress']['cpu'], decompress['wall'], decompress['cpu'])
+
+
+  @staticmethod
+  def add_record(results, name, record):
+    "Add the results for codec name in a result cache record to results."
+    results["_insize"] = record[2]
+    results[name] = {
+      'size': record[1],
+      'compress': {'wall': record[3], 'cpu': record[4]},
+      'decompress': record[5] >= 0 and \
+        {'wall': record[5], 'cpu': record[6]} or None,
+    }
+
+
+  def sweep_results(self, filenames):
+    """
+    Generate the results of processing each message in the HAR files,
+    computing each codec's results for each file (with fresh codec state)
+    in a pool of worker processes, and joining them in file order.
+    """
+    pool = multiprocessing.Pool(self.options.jobs > 1 and self.options.jobs
+                                or None)
+    try:
+      variants = pool.imap(process_variant, [
+        (self.options, spec, filename)
+        for filename in filenames for spec in self.specs])
+      for _ in filenames:
+        records = {}
+        for name, _, _ in self.specs:
+          variant = variants.next()
+          self.output(variant['output'])
+          if variant['unchecked']:
+            self.warn_unchecked(name)
+          self.error(variant['error'])
+          records[name] = variant['records']
+          if variant['profile']:
+            self.profiler.merge(variant['profile'])
+        for index in range(min([len(recs) for recs in records.values()])):
+          results = {}
+          for name, recs in records.items():
+            results["_message_type"] = self.msg_types[recs[index][0]]
+            self.add_record(results, name, recs[index])
+          yield results
+    finally:
+      pool.close()
+      pool.join()
+
+
+  def process_shards(self, filenames):
+    """
+    Process each file in a separate worker, with its own processors, and
+    merge the workers' totals, TSV and error output in file order.
+    """
+    ttls = self.new_ttls()
+    pool = multiprocessing.Pool(self.options.jobs)
+    try:
+      shards = pool.imap(process_shard,
+                         [(self.options, filename) for filename in filenames])
+      for shard in shards:
+        self.output(shard['output'])
+        for name in shard['warned']:
+          self.warn_unchecked(name)
+        self.error(shard['error'])
+        self.merge_ttls(ttls, shard['ttls'])
+        if shard['profile']:
+          self.profiler.merge(shard['profile'])
+        for row in shard['tsv']:
+          self.tsv_row(*row)
+    finally:
+      pool.close()
+      pool.join()
+    return self.finalize_ttls(ttls)
+
+
   def process_messages(self, messages):
     "Process some messages."
-    if len(messages) == 0:
-      sys.stderr.write("Nothing to process.\n")
-      return {}
-    
-    ttls = dict([(msg_type, defaultdict(lambda:{
+    ttls = self.new_ttls()
+    if self.verify_mode == 'async':
+      self.start_verifiers()
+    self.accumulate(ttls, messages)
+    if self.verify_mode == 'async':
+      self.finish_verifiers(ttls)
+    return self.finalize_ttls(ttls)
+
+
+  def new_ttls(self):
+    "Return an empty totals accumulator."
+    return dict([(msg_type, defaultdict(lambda:{
       'size': 0,
-      'maxr': 0,
-      'minr': 1e20,
-      'ratio_list': [],
+      'ratios': RunningStats(accuracy=0.005),
+      'compress': new_timing(),
+      'decompress': new_timing(),
     })) for msg_type in self.msg_types])
-    
-    for (message_type, message, host) in messages:
-      results = self.process_message(message, message_type, host)
+
+
+  def accumulate(self, ttls, messages):
+    """
+    Add the results of processing messages (any iterable of results from
+    process_message()) to the ttls accumulator.
+    """
+    num = 0
+    seen_types = set()
+    for results in messages:
+      message_type = results["_message_type"]
+      num += 1
+      seen_types.add(message_type)
+      self.finish_results(results)
+      if self.sample:
+        self.sample.add(results, self.options.baseline)
       for name, result in results.items():
         if name[0] == "_": 
           continue
         target = ttls[message_type][name]
         target['size'] += result['size']
-        target['maxr'] = max(target['maxr'], result['ratio'])
-        target['minr'] = min(target['minr'], result['ratio'])
-        target['ratio_list'].append(result['ratio'])
-      ttls[message_type]['_num'] = len(messages)
-    
+        target['ratios'].add(result['ratio'])
+        for direction in ['compress', 'decompress']:
+          timing = result[direction]
+          if timing is not None:
+            add_timing(target[direction], timing['wall'], timing['cpu'],
+                       results['_insize'])
+    for message_type in seen_types:
+      ttls[message_type]['_num'] = num
+
+
+  @staticmethod
+  def merge_ttls(ttls, other):
+    "Merge the totals accumulator other into ttls."
+    for message_type, codecs in other.items():
+      target_codecs = ttls[message_type]
+      for name, result in codecs.items():
+        if name == "_num":
+          target_codecs[name] = target_codecs.get(name, 0) + result
+          continue
+        target = target_codecs[name]
+        target['size'] += result['size']
+        target['ratios'].merge(result['ratios'])
+        for direction in ['compress', 'decompress']:
+          merge_timing(target[direction], result[direction])
+
+
+  def finalize_ttls(self, ttls):
+    "Compute the overall ratios of an accumulator; returns ttls."
+    if not [1 for codecs in ttls.values() if '_num' in codecs]:
+      self.error("Nothing to process.\n")
+      return {}
+
     for message_type in self.msg_types:
       baseline_ratio = ttls[message_type][self.options.baseline]['size']
       for name, result in ttls[message_type].items():
         if name[0] == "_":
           continue
         result['ratio'] = 1.0 * result['size'] / baseline_ratio
-        result['std'] = self.meanstdv(result['ratio_list'])[1]
 
     return ttls
 
   
+  def iter_processed(self, messages):
+    """
+    Generate the results of processing (message_type, message, host)
+    tuples, one at a time, or --batch at a time by process_batch().
+    """
+    if self.options.batch <= 1:
+      for message_type, message, host in messages:
+        yield self.process_message(message, message_type, host)
+      return
+    batch = []
+    for message in messages:
+      batch.append(message)
+      if len(batch) == self.options.batch:
+        for results in self.process_batch(batch):
+          yield results
+        batch = []
+    for results in self.process_batch(batch):
+      yield results
+
+
   def process_message(self, message, message_type, host):
     """
     message is a HTTP header dictionary in the format described in
@@ -103,38 +559,87 @@ class CompressionTester(object):
     
     Returns a dictionary of processor names mapped to their results.
     Items in the dictionary whose names start with "_" are metadata.
+    
+    Each result has the 'compress' and 'decompress' wall and CPU times, in
+    seconds; 'decompress' is None if the message wasn't decompressed here.
     """
     procs = [
       (name, proc[self.msg_types.index(message_type)]) for name, proc in \
        self.codec_processors.items()
     ]
-    results = {"_message_type": message_type}
+    message = prepare(message, self.forms)
+    results = {
+      "_message_type": message_type,
+      "_insize": self.message_size(message),
+    }
     for name, processor in procs:
-      compressed = processor.compress(message, host)
-      if self.options.verbose > 2:
-        txt = unicode(compressed, 'utf-8', 'replace') \
-              .encode('utf-8', 'replace')
-        self.output("\n# %s\n%s\n\n" % (name, txt)) 
-      decompressed = None
-      try:
-        decompressed = processor.decompress(compressed)
-      except NotImplementedError:
-        if name not in self.warned.keys():
-          sys.stderr.write("WARNING: %s decompression not checked.\n" % name)
-          self.warned[name] = True
-      if decompressed:
-        compare_result = self.compare_headers(message, decompressed)
-        if compare_result:
-          sys.stderr.write('*** COMPRESSION ERROR in %s.\n' % name)
-          if self.options.verbose >= 1:
-            self.output(compare_result + "\n\n")
-      
-      results[name] = {
-        'compressed': compressed,
-        'decompressed': decompressed,
-        'size': len(compressed)
-      }
+      compressed, wall, cpu = self.call_codec(
+        name, 'compress', processor.compress, message, host)
+      results[name] = self.codec_result(
+        name, message_type, processor, message, compressed,
+        {'wall': wall, 'cpu': cpu})
+
+    return results
+
+
+  def process_batch(self, batch):
+    """
+    Like process_message(), but for a list of (message_type, message,
+    host) tuples; returns a list of results. Each codec compresses the
+    messages of each type with one compress_batch() call, and each message
+    is given an equal share of its time.
+    """
+    batch = [(message_type, prepare(message, self.forms), host)
+             for message_type, message, host in batch]
+    batch_results = [{
+      "_message_type": message_type,
+      "_insize": self.message_size(message),
+    } for message_type, message, _ in batch]
+    for type_index, message_type in enumerate(self.msg_types):
+      indices = [index for index, (batch_type, _, _) in enumerate(batch)
+                 if batch_type == message_type]
+      if not indices:
+        continue
+      messages = [(batch[index][1], batch[index][2]) for index in indices]
+      for name, procs in self.codec_processors.items():
+        processor = procs[type_index]
+        compressed, wall, cpu = self.call_codec(
+          name, 'compress', processor.compress_batch, messages)
+        compress_time = {'wall': wall / len(messages),
+                         'cpu': cpu / len(messages)}
+        for index, blob in zip(indices, compressed):
+          batch_results[index][name] = self.codec_result(
+            name, message_type, processor, batch[index][1], blob,
+            dict(compress_time))
+    return batch_results
 
+
+  def codec_result(self, name, message_type, processor, message, compressed,
+                   compress_time):
+    """
+    Return a codec's result for a message that it compressed (in
+    compress_time) for process_message(), verifying it as --verify says.
+    """
+    if self.options.verbose > 2:
+      txt = unicode(compressed, 'utf-8', 'replace') \
+            .encode('utf-8', 'replace')
+      self.output("\n# %s\n%s\n\n" % (name, txt)) 
+    decompressed, decompress_time = self.verify(
+      name, message_type, processor, message, compressed)
+    return {
+      'compressed': compressed,
+      'decompressed': decompressed,
+      'size': len(compressed),
+      'compress': compress_time,
+      'decompress': decompress_time,
+    }
+
+
+  def finish_results(self, results):
+    """
+    Add the ratio of each codec's size to the baseline's to the results of
+    a message, and output them as requested.
+    """
     if self.options.baseline in results.keys():
       baseline_size = results[self.options.baseline]['size']
       if baseline_size > 0:
@@ -147,9 +652,94 @@ class CompressionTester(object):
       self.tsv_results(results)
 
     if self.options.verbose >= 2 and not self.options.tsv:
-      self.print_results(results, message_type)
+      self.print_results(results, results["_message_type"])
+
+
+  def verify(self, name, message_type, processor, message, compressed):
+    """
+    Decompress and check a compressed message, as --verify says. Returns
+    the decompressed headers and the decompression time, which are None if
+    the message wasn't decompressed here.
+    """
+    if self.verify_mode == 'off':
+      return None, None
+    if self.verify_mode == 'async':
+      self.verifiers[(name, message_type)].put(message, compressed)
+      return None, None
+    self.verify_counts[(name, message_type)] += 1
+    check = self.verify_counts[(name, message_type)] % self.verify_every == 0
+    if not check and not processor.stateful_decompress:
+      return None, None
+    try:
+      decompressed, wall, cpu = self.call_codec(
+        name, 'decompress', processor.decompress, compressed)
+    except NotImplementedError:
+      self.warn_unchecked(name)
+      return None, None
+    if check and decompressed:
+      compare_result = self.compare_headers(message, decompressed,
+                                            processor.unchecked_headers)
+      if compare_result:
+        self.failed.add(name)
+        self.error('*** COMPRESSION ERROR in %s.\n' % name)
+        if self.options.verbose >= 1:
+          self.output(compare_result + "\n\n")
+    return decompressed, {'wall': wall, 'cpu': cpu}
+
+
+  def call_codec(self, name, direction, func, *args):
+    """
+    Call func(*args), the direction ('compress' or 'decompress') of codec
+    name, and return (result, wall seconds, CPU seconds). With --profile,
+    the call is profiled (and so, slowed down).
+    """
+    if self.profiler:
+      return timed(self.profiler.call, name, direction, func, *args)
+    return timed(func, *args)
+
+
+  def start_verifiers(self):
+    "Start a background verifier for each codec and message type."
+    for name, module_name, params in self.specs:
+      for message_type in self.msg_types:
+        self.verifiers[(name, message_type)] = BackgroundVerifier(
+          self.options, name, module_name, params, message_type == 'req')
+
+
+  def finish_verifiers(self, ttls):
+    """
+    Wait for the background verifiers to finish, report their errors and
+    add their decompression timings to ttls.
+    """
+    for (name, message_type), verifier in sorted(self.verifiers.items()):
+      errors, timing, unchecked, profile = verifier.finish()
+      if profile:
+        self.profiler.merge(profile)
+      if unchecked:
+        self.warn_unchecked(name)
+      if errors and self.cache:  # so they're found again next time
+        for path in self.cached.pop(name, []):
+          os.remove(path)
+      for error, compare_result in errors:
+        self.error(error)
+        if self.options.verbose >= 1:
+          self.output(compare_result + "\n\n")
+      if message_type in ttls and name in ttls[message_type]:
+        merge_timing(ttls[message_type][name]['decompress'], timing)
+    self.verifiers = {}
+
+
+  @staticmethod
+  def message_size(message):
+    "Return the number of bytes in a message's header names and values."
+    return sum([len(key) + len(val) for key, val in message.items()])
 
-    return results
+
+  def warn_unchecked(self, name):
+    "Warn, once per codec, that name's decompression isn't checked."
+    if name not in self.warned.keys():
+      self.error("WARNING: %s decompression not checked.\n" % name)
+      self.warned[name] = True
 
   
   def print_results(self, results, message_type, stats=False):
@@ -170,69 +760,161 @@ class CompressionTester(object):
       compressed_size = results[name].get('size', 0)
       pretty_size = locale.format("%13d", compressed_size, grouping=True)
       if stats:
-        minr = results[name].get('minr', 0)
-        maxr = results[name].get('maxr', 0)
-        std = results[name]['std']
+        ratios = results[name]['ratios']
+        timing = self.format_timing(results[name]['compress'])
         lines.append(
-          (message_type, name, pretty_size, ratio, minr, maxr, std)
+          (message_type, name, pretty_size, ratio, ratios.min, ratios.max,
+           ratios.std(), ratios.quantile(0.5), ratios.quantile(0.9),
+           ratios.quantile(0.99), timing)
         )
       else:
         lines.append((message_type, name, pretty_size, ratio))
     
     if stats:
       self.output(
-        '%%%ds        compressed | ratio min   max   std\n' % self.lname % ''
+        '%%%ds        compressed | ratio min   max   std   p50   p90   p99  '
+        '| %%s\n' % self.lname % ('', self.timing_header)
       )
-      fmt = '%%s %%%ds %%s | %%2.2f  %%2.2f  %%2.2f  %%2.2f\n' % self.lname
+      fmt = '%%s %%%ds %%s | %%2.2f  %%2.2f  %%2.2f  %%2.2f  %%2.2f  %%2.2f  ' \
+        '%%2.2f | %%s\n' % self.lname
     else:
       self.output('%%%ds        compressed | ratio\n' % self.lname % '')
       fmt = '%%s %%%ds %%s | %%2.2f\n' % self.lname
     for line in sorted(lines):
       self.output(fmt % line)
 
+    if stats:
+      self.print_decompress_timing(results, message_type)
+
     self.output("\n")
     if self.options.verbose > 1 and not stats:
       self.output("-" * 80 + "\n")
         
 
+  def print_sample(self, message_type):
+    """
+    Output each codec's ratio over all the messages of message_type, as
+    estimated from the --sample, with its 95% confidence interval. Codecs
+    that keep state from message to message are marked, as their estimates
+    are biased.
+    """
+    self.output("%s ratios over all %i messages, estimated from %i in %i "
+                "strata:\n" % ((message_type,) +
+                               self.sample.summary(message_type)))
+    fmt = '%%s %%%ds %%13s | %%2.3f +/- %%2.3f (95%%%% CI)%%s\n' % self.lname
+    processor_num = self.msg_types.index(message_type)
+    stateful = False
+    for name in self.sample.codecs(message_type):
+      ratio, half_width = self.sample.interval(message_type, name)
+      procs = self.codec_processors.get(name)
+      mark = ''
+      if procs and procs[processor_num].stateful_decompress:
+        mark = ' *'
+        stateful = True
+      self.output(fmt % (message_type, name, '', ratio, half_width, mark))
+    if stateful:
+      self.output("* keeps state from message to message, and sees fewer of "
+                  "the messages before\n  each one in the sample, so its "
+                  "ratio is likely overestimated.\n")
+    self.output("\n")
+
+
+  def print_reports(self):
+    "Output what each codec's processors report about their work."
+    fmt = '%%s %%%ds %%s\n' % self.lname
+    lines = []
+    for name, procs in sorted(self.codec_processors.items()):
+      for message_type, processor in zip(self.msg_types, procs):
+        lines.extend([fmt % (message_type, name, line)
+                      for line in processor.report()])
+    if lines:
+      self.output(''.join(lines) + "\n")
+
+
+  def print_decompress_timing(self, results, message_type):
+    "Output decompression timings from a totals object, if there are any."
+    lines = []
+    for name in results.keys():
+      if name[0] == "_" or not results[name]['decompress']['num']:
+        continue
+      lines.append((message_type, name,
+                    self.format_timing(results[name]['decompress'])))
+    if not lines:
+      return
+    self.output(
+      '%%%ds      decompressed | %%40s | %%s\n' % self.lname
+      % ('', '', self.timing_header)
+    )
+    fmt = '%%s %%%ds %%13s | %%40s | %%s\n' % self.lname
+    for message_type, name, timing in sorted(lines):
+      self.output(fmt % (message_type, name, '', '', timing))
+
+
+  @staticmethod
+  def format_timing(timing):
+    """
+    Format the 'compress' or 'decompress' timing totals of a codec as
+    columns for timing_header.
+    """
+    if not timing['num'] or not timing['wall']:
+      return ' '.join(['%7s' % '-'] * 6)
+    return '%9.0f %7.2f %7.1f %7.1f %7.1f %7.1f' % (
+      timing['num'] / timing['wall'],
+      timing['bytes'] / timing['wall'] / 2 ** 20,
+      timing['cpu'] / timing['num'] * 1e6,
+      timing['latency'].quantile(0.50) * 1e6,
+      timing['latency'].quantile(0.95) * 1e6,
+      timing['latency'].quantile(0.99) * 1e6,
+    )
+
+
   def tsv_results(self, results):
     """
-    Store TSV; takes a record number and a results object.
+    Output TSV; takes a results object. Sizes are followed by compression
+    and decompression wall times (in microseconds) for each codec.
     """
-    items = ["%i"]
     codecs = [name for name in results.keys() if name[0] != "_"]
     codecs.sort()
-    for name in codecs:
-      items.append(results[name].get('size', 0))
-    message_type = results["_message_type"]
-    
-    if len(self.tsv_out[message_type]) == 0:
-      self.tsv_out[message_type].append("num\t" + "\t".join(codecs) + "\n")
-    
-    self.tsv_out[message_type].append(
-      "%s\n" % "\t".join([str(item) for item in items])
-    )
+    columns = codecs + ["%s:c_us" % name for name in codecs] + \
+      ["%s:d_us" % name for name in codecs]
+    items = [results[name].get('size', 0) for name in codecs]
+    for direction in ['compress', 'decompress']:
+      for name in codecs:
+        timing = results[name][direction]
+        items.append(timing and "%.1f" % (timing['wall'] * 1e6) or "")
+    self.tsv_row(results["_message_type"], columns, items)
 
 
-  def output_tsv(self):
-    "Write stored TSV to files."
-    for message_type, lines in self.tsv_out.items():
+  def tsv_row(self, message_type, columns, items):
+    """
+    Write a row of TSV for message_type, starting its file (with a header
+    naming its columns) if this is the first one.
+    """
+    if message_type not in self.tsv_out:
       tfh = open("%s%s" % (self.options.prefix, "%s.tsv" % message_type), 'w')
-      count = 0
-      for line in lines:
-        if count == 0:
-          tfh.write(line)
-        else:
-          tfh.write(line % count)
-        count += 1
+      tfh.write("num\t" + "\t".join(columns) + "\n")
+      self.tsv_out[message_type] = [tfh, 0]
+    tsv = self.tsv_out[message_type]
+    tsv[1] += 1
+    tsv[0].write("%i\t%s\n" % (
+      tsv[1], "\t".join([str(item) for item in items])))
+
+
+  def output_tsv(self):
+    "Finish writing TSV files."
+    for tfh, _ in self.tsv_out.values():
       tfh.close()
 
 
-  def get_compressors(self):
+  def codec_specs(self):
     """
-    Get a hash of codec names to processors.
+    Get a list of (name, module_name, params) for the codecs given on the
+    command line, including the variants of each --sweep. Codecs are named
+    by their module, but when a module is given more than once, those with
+    parameters are named like 'spdy3[level:1]'.
     """
-    codec_processors = {}
+    specs = []
+    modules = [codec.split("=", 1)[0] for codec in self.options.codec]
     for codec in self.options.codec:
       if "=" in codec:
         module_name, param_str = codec.split("=", 1)
@@ -242,15 +924,67 @@ class CompressionTester(object):
       else:
         module_name = codec
         params = []
-      if len(module_name) > self.lname:
-        self.lname = len(module_name)
-      module = import_module("compressor.%s" % module_name)
-      codec_processors[module_name] = ( # same order as self.msg_types
-        module.Processor(self.options, True, params),
-        module.Processor(self.options, False, params)
-      )
+      name = module_name
+      if params and modules.count(module_name) > 1:
+        name = "%s[%s]" % (module_name, ','.join(params))
+      if name not in [spec[0] for spec in specs]:
+        specs.append((name, module_name, params))
+    for sweep in self.options.sweep:
+      specs.extend(self.sweep_specs(sweep))
+    return specs
+
+
+  @staticmethod
+  def sweep_specs(sweep):
+    """
+    Expand a --sweep, e.g. 'spdy3=level:1..9;window:10,15', into a list of
+    (name, module_name, params) for every combination of the values given,
+    named like 'spdy3[level:1,window:10]'. Parameters without a ':' are
+    passed to every variant.
+    """
+    module_name, _, param_str = sweep.partition("=")
+    variants = [([], [])]  # [(params, swept params), ...]
+    for param in param_str and param_str.split(';') or []:
+      key, sep, values = [part.strip() for part in param.partition(':')]
+      if not sep:
+        variants = [(params + [key], swept) for params, swept in variants]
+        continue
+      if '..' in values:
+        low, high = values.split('..', 1)
+        values = [str(value) for value in range(int(low), int(high) + 1)]
+      else:
+        values = [value.strip() for value in values.split(',')]
+      variants = [
+        (params + ["%s:%s" % (key, value)], swept + ["%s:%s" % (key, value)])
+        for params, swept in variants for value in values]
+    return [("%s[%s]" % (module_name, ','.join(swept)), module_name, params)
+            for params, swept in variants]
+
+
+  def get_compressors(self):
+    """
+    Get a hash of codec names to processors.
+    """
+    codec_processors = {}
+    for name, module_name, params in self.specs:
+      codec_processors[name] = self.make_processors(module_name, params)
     return codec_processors
 
+
+  def make_processors(self, module_name, params):
+    """
+    Get a (request, response) pair of new processors for a codec, and
+    note the forms they use.
+    """
+    module = import_module("compressor.%s" % module_name)
+    processors = ( # same order as self.msg_types
+      module.Processor(self.options, True, params),
+      module.Processor(self.options, False, params)
+    )
+    for processor in processors:
+      self.forms.update(processor.forms)
+    return processors
+
   @staticmethod
   def parse_options():
     "Parse command-line options and return (options, args)."
@@ -284,56 +1018,399 @@ class CompressionTester(object):
                   dest="prefix",
                   help="Prefix for TSV file output.",
                   default="")
-    return optp.parse_args()
+    optp.add_option('-j', '--jobs',
+                  type='int',
+                  dest='jobs',
+                  help='process HAR files in this many worker processes, '
+                  'each file with fresh codec state (default: %default)',
+                  default=1,
+                  metavar='N')
+    optp.add_option('-s', '--sweep',
+                  action='append',
+                  dest='sweep',
+                  help='also test a variant of a codec for each value of '
+                  'its parameters, in parallel (with -j workers, or one per '
+                  'CPU). e.g. -s spdy3=level:1..9 '
+                  '-s delta=max_vals:256,1024,4096',
+                  default=[],
+                  metavar='CODEC=PARAM:VALUES')
+    optp.add_option('--batch',
+                  type='int',
+                  dest='batch',
+                  help='hand codecs this many messages at a time, which '
+                  'some (e.g., fork) can compress with less overhead; each '
+                  'message is timed as an equal share of its batch '
+                  '(default: %default)',
+                  default=1,
+                  metavar='N')
+    optp.add_option('--verify',
+                  dest='verify',
+                  help='check decompression of all messages, one in every N '
+                  '(sample:N), in background processes (async), or '
+                  'not at all (off). (default: %default)',
+                  default='all',
+                  metavar='all|sample:N|async|off')
+    optp.add_option('--bench',
+                  action="store_true",
+                  dest="bench",
+                  help="benchmark codec speed on the HAR files, without "
+                  "checking or reporting compression.",
+                  default=False)
+    optp.add_option('--bench-runs',
+                  type='int',
+                  dest='bench_reps',
+                  help='timed runs per codec in --bench (default: %default)',
+                  default=5,
+                  metavar='N')
+    optp.add_option('--bench-warmup',
+                  type='int',
+                  dest='bench_warmup',
+                  help='untimed runs per codec before those in --bench '
+                  '(default: %default)',
+                  default=1,
+                  metavar='N')
+    optp.add_option('--cpu',
+                  type='int',
+                  dest='cpu',
+                  help='CPU to pin --bench to (default: the last available)',
+                  default=None,
+                  metavar='N')
+    optp.add_option('--read-jobs',
+                  type='int',
+                  dest='read_jobs',
+                  help='parse HAR files ahead of compression in this many '
+                  'worker processes (default: %default)',
+                  default=1,
+                  metavar='N')
+    optp.add_option('--har-cache',
+                  dest='har_cache',
+                  help='keep the headers parsed from each HAR file in this '
+                  'directory, or next to it (as FILE.hdrs) with "next", and '
+                  'read them from there while the file is unchanged. '
+                  '(default: no cache)',
+                  default=None,
+                  metavar='DIR|next')
+    optp.add_option('--synthetic',
+                  type='int',
+                  dest='synthetic',
+                  help='test this many messages generated from a model of '
+                  'the input files, rather than the files themselves '
+                  '(default: off)',
+                  default=None,
+                  metavar='N')
+    optp.add_option('--synthetic-seed',
+                  type='int',
+                  dest='synthetic_seed',
+                  help='random seed for --synthetic (default: %default)',
+                  default=0,
+                  metavar='N')
+    optp.add_option('--interleave',
+                  action="store_true",
+                  dest="interleave",
+                  help="merge the entries of the HAR files in order of "
+                  "their start times, as a proxy that all of their traffic "
+                  "went through would see them.",
+                  default=False)
+    optp.add_option('--dedup',
+                  action="store_true",
+                  dest="dedup",
+                  help="drop messages that are exact duplicates of earlier "
+                  "ones.",
+                  default=False)
+    optp.add_option('--sample',
+                  type='float',
+                  dest='sample',
+                  help='test a stratified sample of this fraction of the '
+                  'messages (by type, host and size), and estimate the '
+                  'ratios over all of them (default: off)',
+                  default=None,
+                  metavar='FRACTION')
+    optp.add_option('--sample-seed',
+                  type='int',
+                  dest='sample_seed',
+                  help='random seed for --sample (default: %default)',
+                  default=0,
+                  metavar='N')
+    optp.add_option('--profile',
+                  dest='profile',
+                  help='profile each codec\'s compression and decompression, '
+                  'and write name.compress.pstats and name.decompress.pstats '
+                  'to this directory (default: no profiling)',
+                  default=None,
+                  metavar='DIR')
+    optp.add_option('--flamegraph',
+                  action="store_true",
+                  dest="flamegraph",
+                  help="with --profile, also sample call stacks and write "
+                  "them as name.compress.folded and name.decompress.folded "
+                  "for flame graph tools.",
+                  default=False)
+    optp.add_option('--cache-dir',
+                  dest='cache_dir',
+                  help='keep the results of each codec on each HAR file in '
+                  'this directory, and reuse them; files are then processed '
+                  'with fresh codec state. (default: no cache)',
+                  default=None,
+                  metavar='DIR')
+    optp.add_option('--cache-max-age',
+                  type='float',
+                  dest='cache_max_age',
+                  help='remove cached results unused for this long '
+                  '(default: %default)',
+                  default=30,
+                  metavar='DAYS')
+    optp.add_option('--cache-max-size',
+                  type='float',
+                  dest='cache_max_size',
+                  help='remove the least recently used cached results '
+                  'beyond this size (default: %default)',
+                  default=1024,
+                  metavar='MB')
+    options, args = optp.parse_args()
+    try:
+      args = harfile.expand_paths(args)
+    except ValueError as oops:
+      optp.error(str(oops))
+    if not re.match(r"^(all|off|async|sample:[1-9][0-9]*)$", options.verify):
+      optp.error("bad --verify: %s" % options.verify)
+    if options.flamegraph and not options.profile:
+      optp.error("--flamegraph needs --profile")
+    for option in ['synthetic', 'interleave', 'dedup', 'sample']:
+      if getattr(options, option) and (options.jobs > 1 or options.sweep or
+                                       options.cache_dir):
+        optp.error("--%s doesn't work with --jobs, --sweep or --cache-dir"
+                   % option)
+    if options.interleave and options.synthetic:
+      optp.error("--interleave doesn't work with --synthetic")
+    if options.sample is not None and not 0 < options.sample <= 1:
+      optp.error("--sample must be more than 0 and at most 1")
+    for sweep in options.sweep:
+      try:
+        assert re.match(r"^\w+(=[^;]+(;[^;]+)*)?$", sweep)
+        CompressionTester.sweep_specs(sweep)
+      except (AssertionError, ValueError):
+        optp.error("bad --sweep: %s" % sweep)
+    return options, args
 
   
   @staticmethod
-  def compare_headers(a_hdr, b_hdr):
+  def compare_headers(a_hdr, b_hdr, unchecked=()):
     """
     Compares two dicts of headers, and returns a message denoting any
-    differences. It ignores ordering differences in cookies, but tests that
-    all the content does exist in both.
+    differences. It ignores hop-by-hop headers, those named in unchecked
+    and ordering differences in cookies, but tests that all the content
+    does exist in both.
     If nothing is different, it returns an empty string.
     """
     output = []
-    for d_hdr in [a_hdr, b_hdr]:
-      if 'cookie' in d_hdr.keys():
-        splitvals = d_hdr['cookie'].split(';')
-        d_hdr['cookie'] = \
-          '; '.join(sorted([x.lstrip(' ') for x in splitvals]))
+    unchecked = [':version'] + list(unchecked)
+    a_hdr, b_hdr = stripped_headers(a_hdr), stripped_headers(b_hdr)
     for (key, val) in a_hdr.iteritems():
-      if key in [':version']:
-        pass
+      if key in unchecked:
+        continue
       elif not key in b_hdr:
         output.append('\t%s present in only one (A)' % key)
         continue
-      elif val.strip() != b_hdr[key].strip():
+      b_val = b_hdr[key]
+      if key == 'cookie':
+        val, b_val = ['; '.join(cookie_crumbs(hdr)) for hdr in [a_hdr, b_hdr]]
+      if val.strip() != b_val.strip():
         output.append('\t%s has mismatched values:' % key)
         output.append('\t  a -> %s' % val)
-        output.append('\t  b -> %s' % b_hdr[key])
-      del b_hdr[key]
+        output.append('\t  b -> %s' % b_val)
     for key in b_hdr.keys():
+      if key not in a_hdr and key not in unchecked:
         output.append('\t%s present in only one (B)' % key)
     return '\n'.join(output)
 
 
-  @staticmethod
-  def meanstdv(members):
+
+class ShardTester(CompressionTester):
+  """
+  Processes one shard of a --jobs run in a worker process. Output is
+  buffered so that the parent can merge shards in order.
+  """
+  def __init__(self, options, args):
+    options = copy.copy(options)
+    options.read_jobs = 1  # pool workers can't have workers of their own
+    CompressionTester.__init__(self, options, args)
+    self.output_buf = []
+    self.error_buf = []
+    self.output = self.output_buf.append
+    self.error = self.error_buf.append
+    self.tsv_rows = []
+    if self.verify_mode == 'async':
+      self.verify_mode = 'all'
+
+  def profile_snapshot(self):
+    "Stop profiling, and return the profiles for the parent to write."
+    self.profiler.stop()
+    return self.profiler.snapshot()
+
+  def tsv_row(self, message_type, columns, items):
+    "Leave TSV to the parent, so that rows are numbered across shards."
+    self.tsv_rows.append((message_type, columns, items))
+
+  def warn_unchecked(self, name):
+    "Leave warnings to the parent, so they're only shown once."
+    self.warned[name] = True
+
+
+def process_variant(variant):
+  """
+  Worker entry point for --sweep; variant is (options, (name, module_name,
+  params), filename). Returns the result cache records of the codec for
+  each message in the file, and its output.
+  """
+  options, spec, filename = variant
+  tester = ShardTester(options, [filename])
+  tester.specs = [spec]
+  records = [tester.cache_record(results, spec[0])
+             for results in tester.iter_results([filename])]
+  tester.print_reports()
+  return {
+    'records': records,
+    'output': ''.join(tester.output_buf),
+    'error': ''.join(tester.error_buf),
+    'unchecked': spec[0] in tester.warned,
+    'profile': tester.profiler and tester.profile_snapshot(),
+  }
+
+
+def process_shard(shard):
+  """
+  Worker entry point for --jobs; shard is (options, filename). Returns the
+  shard's totals, TSV rows, output and the names of unchecked codecs.
+  """
+  options, filename = shard
+  tester = ShardTester(options, [filename])
+  ttls = tester.new_ttls()
+  tester.accumulate(ttls, tester.iter_results([filename]))
+  tester.print_reports()
+  return {
+    'ttls': dict([(msg_type, dict(codecs))
+                  for msg_type, codecs in ttls.items()]),
+    'tsv': tester.tsv_rows,
+    'output': ''.join(tester.output_buf),
+    'error': ''.join(tester.error_buf),
+    'warned': tester.warned.keys(),
+    'profile': tester.profiler and tester.profile_snapshot(),
+  }
+
+
+class BackgroundVerifier(object):
+  """
+  Decompresses and checks the messages compressed by one codec for one
+  message type in a separate process, for --verify=async. Messages are
+  handed over through a bounded queue, so that a slow decompressor holds
+  up compression rather than filling memory.
+  """
+  queue_size = 1000
+
+  def __init__(self, options, name, module_name, params, is_request):
+    self.name = name
+    self.inbox = multiprocessing.Queue(self.queue_size)
+    self.outbox = multiprocessing.Queue()
+    self.unchecked = multiprocessing.Event()
+    self.process = multiprocessing.Process(
+      target=self.work, args=(options, module_name, params, is_request))
+    self.process.daemon = True
+    self.process.start()
+
+  def reset(self):
+    "Start decompressing with fresh codec state."
+    self.inbox.put('reset')
+
+  def put(self, message, compressed):
+    "Queue a message and its compressed form for checking."
+    if not self.unchecked.is_set():  # don't bother if it can't decompress
+      self.inbox.put((dict(message), compressed))
+
+  def finish(self):
     """
-    Calculate mean and standard deviation of data x[]:
-        mean = {\sum_i x_i \over n}
-        std = sqrt(\sum_i (x_i - mean)^2 \over n-1)
+    Wait for the queued messages to be checked. Returns a list of
+    (error, comparison) for the mismatched ones, the decompression timing,
+    whether the codec couldn't decompress and a CodecProfiler snapshot (or
+    None, without --profile).
     """
-    from math import sqrt
-    num, mean, std = len(members), 0, 0
-    for item in members:
-      mean = mean + item
-    mean = mean / float(num)
-    for item in members:
-      std = std + (item - mean)**2
-    std = sqrt(std / float(num - 1))
-    return mean, std
+    self.inbox.put(None)
+    errors, timing, profile = self.outbox.get()
+    self.process.join()
+    return errors, timing, self.unchecked.is_set(), profile
+
+  def work(self, options, module_name, params, is_request):
+    "Run in the background process."
+    options = copy.copy(options)
+    options.verify = 'all'  # it's this process that decompresses
+    module = import_module("compressor.%s" % module_name)
+    processor = module.Processor(options, is_request, params)
+    errors = []
+    timing = new_timing()
+    profiler = None
+    if options.profile:
+      profiler = CodecProfiler(
+        options.flamegraph and CompressionTester.sample_interval or None)
+    for item in iter(self.inbox.get, None):
+      if item == 'reset':
+        processor = module.Processor(options, is_request, params)
+        continue
+      if self.unchecked.is_set():
+        continue
+      message, compressed = item
+      try:
+        if profiler:
+          decompressed, wall, cpu = timed(profiler.call, self.name,
+            'decompress', processor.decompress, compressed)
+        else:
+          decompressed, wall, cpu = timed(processor.decompress, compressed)
+      except NotImplementedError:
+        self.unchecked.set()
+        continue
+      add_timing(timing, wall, cpu, CompressionTester.message_size(message))
+      if decompressed:
+        compare_result = CompressionTester.compare_headers(
+          message, decompressed, processor.unchecked_headers)
+        if compare_result:
+          errors.append(
+            ('*** COMPRESSION ERROR in %s.\n' % self.name, compare_result))
+    if profiler:
+      profiler.stop()
+    self.outbox.put((errors, timing, profiler and profiler.snapshot()))
+
+
+def new_timing():
+  "Return empty timing totals for compression or decompression."
+  return {'wall': 0.0, 'cpu': 0.0, 'num': 0, 'bytes': 0,
+          'latency': QuantileSketch()}
+
+
+def add_timing(timing, wall, cpu, size):
+  """
+  Add the times taken by one call, for a message with size bytes of
+  headers, to timing totals.
+  """
+  timing['wall'] += wall
+  timing['cpu'] += cpu
+  timing['num'] += 1
+  timing['bytes'] += size
+  timing['latency'].add(wall)
+
+
+def merge_timing(timing, other):
+  "Add the timing totals other to timing."
+  for key in ['wall', 'cpu', 'num', 'bytes']:
+    timing[key] += other[key]
+  timing['latency'].merge(other['latency'])
+
+
+def median(values):
+  "Return the median of a non-empty list of numbers."
+  values = sorted(values)
+  middle = len(values) // 2
+  if len(values) % 2:
+    return values[middle]
+  return (values[middle - 1] + values[middle]) / 2.0
 
 
 if __name__ == "__main__":
-  CompressionTester()
+  CompressionTester().run()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# pylint: disable=W0311
+
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HOSTS = ['www.example.com', 'static.example.com', 'api.example.com',
+         'ads.example.net']
+
+
+def Check(what, value, expected):
+  if value != expected:
+    print "Failure!: %s is %r; expected %r" % (what, value, expected)
+    raise StandardError()
+
+
+def write_har(path, seed, count):
+  "Write a HAR file of count made-up entries."
+  rand = random.Random(seed)
+  entries = []
+  for number in range(count):
+    host = rand.choice(HOSTS)
+    entries.append({
+      "request": {
+        "method": rand.choice(["GET", "GET", "POST"]),
+        "url": "http://%s/%s/%i.js?q=%i" % (
+          host, rand.choice(["js", "img", "a/b"]), rand.randint(0, 50),
+          rand.randint(0, 1000)),
+        "httpVersion": "HTTP/1.1",
+        "headers": [
+          {"name": "Host", "value": host},
+          {"name": "User-Agent", "value": "Mozilla/5.0 Firefox/%i.0" % seed},
+          {"name": "Accept", "value": "*/*"},
+          {"name": "Cookie", "value": "a=%i; s=%x" % (
+            number % 3, rand.randint(0, 1 << 30))}],
+      },
+      "response": {
+        "status": rand.choice([200, 200, 304, 404]),
+        "statusText": "",
+        "httpVersion": "HTTP/1.1",
+        "headers": [
+          {"name": "Date", "value": "Mon, 01 Oct 2012 12:00:%02i GMT" % (
+            number % 60)},
+          {"name": "Content-Length", "value": str(rand.randint(10, 9999))},
+          {"name": "Content-Type", "value": "text/javascript"}],
+        "content": {"size": 3, "text": "a;b"},
+      },
+    })
+  hfh = open(path, 'w')
+  json.dump({"log": {"entries": entries}}, hfh)
+  hfh.close()
+
+
+def compare(*args):
+  """
+  Run compare_compressors.py, and return {(message type, codec): compressed
+  size} from its output.
+  """
+  proc = subprocess.Popen(
+    [sys.executable, os.path.join(HERE, 'compare_compressors.py')] +
+    list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  output, error = proc.communicate()
+  if proc.returncode:
+    print "Failure!: %s exited with %i:\n%s" % (
+      ' '.join(args), proc.returncode, error)
+    raise StandardError()
+  sizes = {}
+  for line in output.splitlines():
+    fields = line.split()
+    if len(fields) > 3 and fields[0] in ('req', 'res') and \
+       fields[2].isdigit():
+      sizes[fields[0], fields[1]] = int(fields[2])
+  return sizes
+
+
+def main():
+  directory = tempfile.mkdtemp()
+  try:
+    filenames = []
+    for seed in range(3):
+      filenames.append(os.path.join(directory, '%i.har' % seed))
+      write_har(filenames[-1], seed, 40 + 10 * seed)
+    serial = compare('-c', 'spdy3', *filenames)
+    Check("codecs compared", sorted(serial), [
+      ('req', 'http1'), ('req', 'spdy3'), ('res', 'http1'), ('res', 'spdy3')])
+
+    # workers read their own files, rather than starting readers of their own
+    for args in [['-j', '2'], ['-s', 'spdy3=level:1,9']]:
+      args = ['-c', 'spdy3'] + args
+      Check("sizes with %s and --read-jobs" % ' '.join(args),
+            compare(*(args + ['--read-jobs', '2'] + filenames)),
+            compare(*(args + filenames)))
+  finally:
+    shutil.rmtree(directory)
+  print "Success!"
+
+
+main()
@@ -8,11 +8,36 @@ Base class and common functions for compressor implementations.
 
 class BaseProcessor(object):
   "Base class for compression processors."
+
+  # Names of the derived forms (see prepare()) of the headers that
+  # compress() uses, so that they can be computed before it's timed. It's
+  # read from each processor, so it can depend on the processor's params.
+  forms = []
+
+  # Whether decompress() depends on the messages decompressed before, so
+  # that it has to see every message even when only some are checked.
+  stateful_decompress = True
+
+  # Names of headers that the form of messages given to the codec doesn't
+  # carry, so that decompress() can't restore them and they aren't checked.
+  unchecked_headers = []
+
   def __init__(self, options, is_request, params):
     self.options = options
     self.is_request = is_request
     self.params = params
 
+  def param(self, name, default, cast=int):
+    """
+    Return the value of the 'name:value' parameter (e.g., from
+    -c spdy3=level:9) converted by cast, or default if it isn't given.
+    """
+    for param in self.params:
+      key, sep, value = param.partition(':')
+      if sep and key.strip() == name:
+        return cast(value.strip())
+    return default
+
   def compress(self, in_headers, host):
     """
     'in_headers' are the headers that will be processed. They are expected
@@ -23,6 +48,10 @@ class BaseProcessor(object):
     There are a number of special header names, indicated by ':' as the
     first character in the name.
 
+    'in_headers' is shared with other processors and must not be changed.
+    It's usually a HeaderMessage, so forms derived from it (e.g., by
+    http1_text()) are shared as well.
+
     'host' is the host header value for the request (or associated request,
     if it is a response).
        
@@ -30,6 +59,15 @@ class BaseProcessor(object):
     """
     raise NotImplementedError
 
+  def compress_batch(self, messages):
+    """
+    Compress a list of (in_headers, host), in order, as compress() does,
+    and return the list of results. Processors that can do better than
+    compressing one message at a time (e.g., by handing them all to another
+    process at once) override this.
+    """
+    return [self.compress(in_headers, host) for in_headers, host in messages]
+
   def decompress(self, compressed):
     """
     'compressed' is the compressed headers.
@@ -37,6 +75,79 @@ class BaseProcessor(object):
     Return value is a header dictionary, as described above.
     """
     raise NotImplementedError
+
+  def report(self):
+    """
+    Return a list of lines about how the processor did its work (e.g., the
+    fork codec's workers), to show after the results; most have none.
+    """
+    return []
+
+
+class HeaderMessage(dict):
+  """
+  An unchangeable header dictionary, which keeps the forms derived from it
+  so that each is only computed once, however many processors use it.
+  """
+  def __init__(self, *args, **kwargs):
+    dict.__init__(self, *args, **kwargs)
+    self._derived = {}
+
+  def derive(self, name, func):
+    "Return the derived form 'name', computing it with func the first time."
+    try:
+      return self._derived[name]
+    except KeyError:
+      value = self._derived[name] = func(self)
+      return value
+
+  def _unchangeable(self, *args, **kwargs):
+    raise TypeError("HeaderMessage can't be changed")
+  __setitem__ = __delitem__ = _unchangeable
+  clear = pop = popitem = setdefault = update = _unchangeable
+
+  def __reduce__(self):
+    return (HeaderMessage, (dict(self),))
+
+
+def prepare(headers, forms=()):
+  """
+  Return a header dictionary as a HeaderMessage, with the named derived
+  forms (keys of DERIVED_FORMS) already computed.
+  """
+  if not isinstance(headers, HeaderMessage):
+    if not isinstance(headers, dict):  # e.g., a corpus.HeaderView
+      headers = dict(headers)  # so it iterates as the parsed dict did
+    headers = HeaderMessage(headers)
+  for name in forms:
+    derived(headers, name)
+  return headers
+
+
+def derived(headers, name):
+  """
+  Return the derived form 'name' of a header dictionary; it's only computed
+  once for a HeaderMessage.
+  """
+  func = DERIVED_FORMS[name]
+  if isinstance(headers, HeaderMessage):
+    return headers.derive(name, func)
+  return func(headers)
+
+
+def http1_text(headers):
+  "Return headers formatted as HTTP/1 by format_http1()."
+  return derived(headers, 'http1')
+
+
+def stripped_headers(headers):
+  "Return headers without hop-by-hop headers, as by strip_conn_headers()."
+  return derived(headers, 'stripped')
+
+
+def cookie_crumbs(headers):
+  "Return the sorted list of crumbs in the cookie header, if any."
+  return derived(headers, 'cookie_crumbs')
     
     
 def format_http1(frame, delimiter="\r\n", valsep=": ", host='host'):
@@ -69,17 +180,23 @@ def format_http1(frame, delimiter="\r\n", valsep=": ", host='host'):
   
   
 def strip_conn_headers(hdrs):
-  """Remove hop-by-hop headers from a header dictionary."""
+  """
+  Return a copy of a header dictionary without hop-by-hop headers, as a
+  HeaderMessage.
+  """
   hop_by_hop = ['transfer-encoding', 'te', 'keep-alive', 'trailers']
   if hdrs.has_key('connection'):
     hop_by_hop.extend([v.strip() for v in hdrs['connection'].split(None)])
-    del hdrs['connection']
-  for hdr in hop_by_hop:
-    try:
-      del hdrs[hdr]
-    except KeyError:
-      pass
-  return hdrs
+    hop_by_hop.append('connection')
+  return HeaderMessage(
+    [(name, val) for name, val in hdrs.items() if name not in hop_by_hop])
+
+
+def split_cookie(hdrs):
+  """Return the sorted crumbs of the cookie header in hdrs."""
+  if 'cookie' not in hdrs:
+    return []
+  return sorted([crumb.lstrip(' ') for crumb in hdrs['cookie'].split(';')])
 
 
 def parse_http1(message):
@@ -107,4 +224,14 @@ def parse_http1(message):
     out[':version'] = top_line[0]
     out[':status'] = top_line[1]
     out[':status-text'] = top_line[2].strip()
-  return out
\ No newline at end of file
+  return out
+
+
+# Forms derived from header dictionaries that can be shared between
+# processors; codec modules may add their own.
+DERIVED_FORMS = {
+  'http1': format_http1,
+  'stripped': strip_conn_headers,
+  'stripped_http1': lambda hdrs: http1_text(stripped_headers(hdrs)),
+  'cookie_crumbs': split_cookie,
+}
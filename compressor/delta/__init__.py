@@ -23,11 +23,17 @@ class Processor(BaseProcessor):
   It also keeps track of letter frequencies so that better frequency tables
   can eventually be constructed for use with the Huffman encoder.
   """
+  forms = ['cookie_crumbs']
+
   def __init__(self, options, is_request, params):
-    # 'params' is ignored
+    BaseProcessor.__init__(self, options, is_request, params)
     self.compressor   = spdy4_codec_impl.Spdy4CoDe()
     self.decompressor = spdy4_codec_impl.Spdy4CoDe()
-    self.options = options
+    for codec in [self.compressor, self.decompressor]:
+      storage = codec.storage
+      storage.max_vals = self.param('max_vals', storage.max_vals)
+      storage.max_state_size = self.param('max_state_size',
+                                          storage.max_state_size)
     self.hosts = {}
     self.group_ids = common_utils.IDStore()
     self.wf = self.compressor.wf
@@ -0,0 +1,108 @@
+// Copyright (c) 2012 The Chromium Authors. All rights reserved.
+// Use of this source code is governed by a BSD-style license that can be
+// found in the LICENSE file.
+#ifndef CORPUS_FILE_H
+#define CORPUS_FILE_H
+
+#include <fcntl.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include <cstring>
+#include <iostream>
+#include <string>
+#include <vector>
+
+#include "trivial_http_parse.h"
+
+// Reads the corpus files written by corpus.py (see there for the format),
+// on little-endian machines.
+class CorpusFile {
+ private:
+  struct Header {
+    char magic[8];
+    uint32_t num_strings;
+    uint32_t num_messages;
+    uint32_t num_indices;
+    uint32_t reserved;
+    uint64_t heap_size;
+  };
+
+  static size_t Padded(size_t size) {
+    return (size + 7) & ~static_cast<size_t>(7);
+  }
+
+ public:
+  // Appends the messages in the corpus file fn to requests and responses.
+  // Returns 0 if it can't be read.
+  static int Read(const char* fn,
+                  std::vector<HeaderFrame>* requests,
+                  std::vector<HeaderFrame>* responses) {
+    int fd = open(fn, O_RDONLY);
+    if (fd == -1) {
+      perror(fn);
+      return 0;
+    }
+    struct stat st;
+    if (fstat(fd, &st) == -1 ||
+        static_cast<size_t>(st.st_size) < sizeof(Header)) {
+      std::cerr << fn << ": not a corpus file\n";
+      close(fd);
+      return 0;
+    }
+    const char* base = static_cast<const char*>(
+        mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0));
+    close(fd);
+    if (base == MAP_FAILED) {
+      perror(fn);
+      return 0;
+    }
+    Header header;
+    std::memcpy(&header, base, sizeof(header));
+    if (std::memcmp(header.magic, "ctcorp01", 8) != 0) {
+      std::cerr << fn << ": not a corpus file\n";
+      munmap(const_cast<char*>(base), st.st_size);
+      return 0;
+    }
+
+    size_t offset = sizeof(header);
+    const uint64_t* string_ends =
+        reinterpret_cast<const uint64_t*>(base + offset);
+    offset += Padded(8 * (header.num_strings + 1));
+    const uint32_t* starts = reinterpret_cast<const uint32_t*>(base + offset);
+    offset += Padded(4 * (header.num_messages + 1));
+    const uint8_t* types = reinterpret_cast<const uint8_t*>(base + offset);
+    offset += Padded(header.num_messages);
+    offset += Padded(4 * header.num_messages);  // hosts
+    const uint32_t* indices =
+        reinterpret_cast<const uint32_t*>(base + offset);
+    offset += Padded(4 * header.num_indices);
+    const char* heap = base + offset;
+    if (offset + header.heap_size > static_cast<size_t>(st.st_size)) {
+      std::cerr << fn << ": truncated corpus file\n";
+      munmap(const_cast<char*>(base), st.st_size);
+      return 0;
+    }
+
+    for (uint32_t msg = 0; msg < header.num_messages; ++msg) {
+      std::vector<HeaderFrame>* frames = types[msg] ? responses : requests;
+      frames->push_back(HeaderFrame());
+      HeaderFrame& frame = frames->back();
+      for (uint32_t i = starts[msg]; i < starts[msg + 1]; i += 2) {
+        uint32_t key = indices[i], val = indices[i + 1];
+        frame.push_back(KVPair(
+            std::string(heap + string_ends[key],
+                        string_ends[key + 1] - string_ends[key]),
+            std::string(heap + string_ends[val],
+                        string_ends[val + 1] - string_ends[val])));
+      }
+    }
+    munmap(const_cast<char*>(base), st.st_size);
+    return 1;
+  }
+};
+
+#endif  // CORPUS_FILE_H
@@ -15,6 +15,7 @@ from common_utils import *
 from huffman import Huffman
 from optparse import OptionParser
 from ..spdy_dictionary import spdy_dict
+from .. import cookie_crumbs
 from word_freak import WordFreak
 
 options = {}
@@ -916,9 +917,7 @@ class Spdy4CoDe(object):
         incremented_keys.append(ke)
     for k,v in headers.iteritems():
       if k == 'cookie':
-        splitvals = [x.lstrip(' ') for x in v.split(';')]
-        splitvals.sort()
-        for splitval in splitvals:
+        for splitval in cookie_crumbs(headers):
           self.ProcessKV(k, splitval, group_id, instructions)
       else:
         self.ProcessKV(k, v, group_id, instructions)
@@ -12,6 +12,7 @@
 #include <cstring>
 
 #include "bit_bucket.h"
+#include "corpus_file.h"
 #include "header_freq_tables.h"
 #include "huffman.h"
 #include "trivial_http_parse.h"
@@ -25,57 +26,6 @@ using std::fixed;
 using std::cout;
 using std::cerr;
 
-int ParseHarFiles(int n_files, char** files,
-                   vector<HeaderFrame>* requests,
-                   vector<HeaderFrame>* responses) {
-  int pipe_fds[2];  // read, write
-  int pipe_retval = pipe(pipe_fds);
-  if (pipe_retval == -1) {
-    perror("");
-    abort();
-  }
-  pid_t child_pid;
-  if ((child_pid = fork()) == -1) {
-    perror("Fork failed");
-    abort();
-  }
-  if (child_pid == 0) {
-    dup2(pipe_fds[1], 1);
-    char** new_argv = new char*[n_files + 2];
-    new_argv[0] =(char*) "./harfile_translator.py";
-    for (int i = 0; i < n_files; ++i) {
-      new_argv[i + 1] = files[i];
-    }
-    new_argv[n_files + 1] = 0;
-    if (execvp(new_argv[0], new_argv) == -1) {
-      perror("Great: ");
-      abort();
-    }
-  } else {
-    close(pipe_fds[1]);
-  }
-
-  stringstream input;
-  char buf[256];
-  ssize_t bytes_read = 0;
-  while ((bytes_read = read(pipe_fds[0], &buf, sizeof(buf)-1))) {
-    if (bytes_read < 0) {
-      if (errno == EINTR) {
-        continue;
-      }
-      break;
-    } else {
-      buf[bytes_read] = 0;
-      input << buf;
-    }
-  }
-  if (!TrivialHTTPParse::ParseStream(input, requests, responses)) {
-    cerr << "Failed to parse correctly. Exiting\n";
-    return 0;
-  }
-  return 1;
-}
-
 class SimpleTimer {
   timespec ts_start;
   timespec ts_end;
@@ -358,7 +308,12 @@ void PrintSummary(const string& protocol_name,
 int main(int argc, char** argv) {
   vector<HeaderFrame> requests;
   vector<HeaderFrame> responses;
-  ParseHarFiles(argc-1, argv+1, &requests, &responses);
+  // Export HAR files to corpus files with corpus.py.
+  for (int i = 1; i < argc; ++i) {
+    if (!CorpusFile::Read(argv[i], &requests, &responses)) {
+      return 1;
+    }
+  }
 
   size_t request_header_bytes = 0;
   size_t header_count = 0;
@@ -2,27 +2,493 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+"""
+Runs an external codec in a child process, talking to it over its stdin
+and stdout; see sample_exec_codec.py for an example.
+
+Protocol 1 sends one message at a time: the message as HTTP/1 (ending
+with an empty line), answered by its compressed size as a native 8-byte
+integer and then the compressed bytes.
+
+Protocol 2 sends messages in batches: the number of messages and then,
+for each, its size and HTTP/1 bytes, all sizes being native 8-byte
+integers. The child reads the whole batch before answering with the size
+and bytes of each compressed message, in order.
+
+Protocol 1 is used unless the 'protocol:2' parameter is given (or
+'transport:shm', 'format:binary' or 'workers:N', which need it); then it's
+negotiated at startup: the first message sent is an empty one (just the
+empty line), which a child that speaks protocol 2 answers with
+PROTOCOL_2_HELLO, and then switches to it. Any other answer is taken to be
+a protocol 1 child's compression of the empty message; as that has
+changed the child's state, it's restarted, and spoken to by protocol 1.
+
+In protocol 2, negative counts are control messages:
+
+  -1  attach shared memory: the size of the path of a file and the path,
+      answered by 0 if the child has mapped the file, or else 1.
+  -2  doorbell: the offset and size of a batch in the driver's ring,
+      answered by the offset and size of the results in the child's ring,
+      or by -1 and the size, followed by the results themselves.
+  -3  decode: from then on, the child is sent batches of what it
+      compressed, in order, and answers with each message as HTTP/1 (as
+      it was sent); answered by 0, or 1 if it can't decompress.
+  -4  header lists: from then on, messages are sent (and decoded messages
+      answered) as header lists rather than HTTP/1; answered by 0, or 1 if
+      the child can't take them.
+
+With 'format:binary', a child whose hello lists "binary" is switched to
+header lists with -4. A header list is the number of headers and then,
+for each, the size and bytes of its name and of its value, all sizes
+being native 8-byte integers. The headers are exactly those of the header
+dictionary the other codecs are given (without hop-by-hop headers), in its
+order: pseudo-headers such as :scheme are kept, and values of repeated
+headers stay joined by \0.
+
+Unless --verify is 'off', a second child is run for decompression (by the
+background verifier, with --verify=async), and switched to decoding with
+-3; with protocol 1, or if it can't decode,
+decompression isn't supported. Decoded messages are parsed with
+compressor.parse_http1(). HTTP/1 doesn't carry the :scheme of requests,
+so it isn't checked (unless header lists are used).
+
+With 'transport:shm', when the child's hello lists "shm", batches go
+through a file in shared memory instead of the pipes, and the pipes only
+carry doorbells. The file holds two rings of 'shm_kb' kilobytes each
+(4096 by default): the driver's, which batches are written to, and then
+the child's, which results are written to. Each is written from where the
+last write ended, or from its start if there isn't room; as each side
+waits for the other's answer, nothing in a ring is still being read when
+it's overwritten. A batch that doesn't fit in the driver's ring is sent
+through the pipe.
+
+With 'workers:N', N children (each a simulated connection, with its own
+state) compress at once, if they speak protocol 2: each message goes to
+the child picked by its host, and each child is sent its share of a batch
+in rounds of at most 'inflight' messages (64 by default), through
+non-blocking pipes that are polled, so that a slow child doesn't hold up
+the others. Pooled children always use the pipes. Each has its own
+decoder: their answers are PooledAnswers, which keep the index of the
+child that made them, so that each is decompressed by that child's
+decoder (even in another process, with --verify=async).
+"""
+
+from collections import deque
+import errno
+import fcntl
+import mmap
 import os
+import select
 import subprocess
 import struct
 import sys
+import tempfile
+import zlib
 
-from .. import BaseProcessor, format_http1, strip_conn_headers
+from .. import BaseProcessor, DERIVED_FORMS, derived, parse_http1, \
+  stripped_headers
+from stats import RunningStats, wall_clock
+
+PROTOCOL_2_HELLO = 'fork-codec protocol:2'
 
 class Processor(BaseProcessor):
+  forms = ['stripped_http1']
+  unchecked_headers = [':scheme']
+
   def __init__(self, options, is_request, params):
     BaseProcessor.__init__(self, options, is_request, params)
     path = os.path.join(os.getcwd(), params[0])
-    self.process = subprocess.Popen(path,
-                                    #bufsize=-1,
-                                    shell=False,
-                                    stdout=subprocess.PIPE,
-                                     stdin=subprocess.PIPE)
+    protocol = self.param('protocol', 1)
+    transport = self.param('transport', 'pipe', str)
+    ring_size = max(1, self.param('shm_kb', 4096)) << 10
+    header_format = self.param('format', 'http1', str)
+    workers = max(1, self.param('workers', 1))
+    if transport == 'shm' or header_format == 'binary' or workers > 1:
+      protocol = 2
+    if workers > 1:
+      transport = 'pipe'
+    args = (path, protocol, transport, ring_size, header_format)
+    self.encoder = Child(*args)
+    self.form, self.parse = 'stripped_http1', parse_http1
+    if self.encoder.binary:
+      self.form, self.parse = 'stripped_binary', parse_header_list
+      self.forms = [self.form]
+      self.unchecked_headers = []
+    self.pool = None
+    encoders = [self.encoder]
+    if workers > 1 and self.encoder.protocol == 2:
+      encoders.extend([Child(*args) for _ in range(workers - 1)])
+      self.pool = Pool(encoders, max(1, self.param('inflight', 64)))
+    self.decoders = None
+    if getattr(options, 'verify', 'all') not in ('off', 'async') and \
+        self.encoder.protocol == 2:
+      self.decoders = []
+      for _ in encoders:
+        decoder = Child(*args)
+        self.decoders.append(decoder)
+        if decoder.binary != self.encoder.binary or not decoder.decode():
+          for decoder in self.decoders:
+            decoder.stop()
+          self.decoders = None
+          break
 
   def compress(self, in_headers, host):
-    http1_msg = format_http1(strip_conn_headers(in_headers))
-    self.process.stdin.write(http1_msg)
-    output = self.process.stdout.read(8)
-    size = struct.unpack("q", output)[0]
-    output = self.process.stdout.read(int(size))
-    return output
+    return self.compress_batch([(in_headers, host)])[0]
+
+  def compress_batch(self, messages):
+    if self.pool is None:
+      return self.encoder.send([derived(in_headers, self.form)
+                                for in_headers, _ in messages])
+    assignments = [(self.pool.route(host), derived(in_headers, self.form))
+                   for in_headers, host in messages]
+    return self.pool.send(assignments)
+
+  def decompress(self, compressed):
+    if not self.decoders:
+      raise NotImplementedError
+    if self.pool is None:
+      decoder = self.decoders[0]
+    elif isinstance(compressed, PooledAnswer):
+      decoder = self.decoders[compressed.worker]
+    else:
+      raise NotImplementedError
+    return self.parse(decoder.send([compressed])[0])
+
+  def report(self):
+    if self.pool is None:
+      return []
+    return [worker.report() for worker in self.pool.workers]
+
+
+class Child(object):
+  """
+  An external codec process, and the protocol (and, with protocol 2, the
+  transport and message format) it's spoken to by.
+  """
+  def __init__(self, path, protocol, transport, ring_size, header_format):
+    self.process = self.start(path)
+    self.protocol = 1
+    self.rings = None
+    self.binary = False  # whether messages are sent as header lists
+    if protocol < 2:
+      return
+    hello = self.send_one("\r\n")
+    if not hello.startswith(PROTOCOL_2_HELLO):
+      self.stop()  # it has compressed the empty message
+      self.process = self.start(path)
+      return
+    self.protocol = 2
+    features = hello[len(PROTOCOL_2_HELLO):].split()
+    if transport == 'shm' and 'shm' in features:
+      self.rings = self.attach_rings(ring_size)
+    if header_format == 'binary' and 'binary' in features:
+      self.binary = self.control(struct.pack("q", -4)) == 0
+
+  @staticmethod
+  def start(path):
+    "Start the child process."
+    return subprocess.Popen(path,
+                            bufsize=-1,
+                            shell=False,
+                            stdout=subprocess.PIPE,
+                            stdin=subprocess.PIPE)
+
+  def stop(self):
+    "Stop the child (if it's still running), and return its exit status."
+    try:
+      self.process.stdin.close()
+    except IOError:
+      pass  # it has exited with data unread
+    if self.process.poll() is None:
+      self.process.terminate()
+    return self.process.wait()
+
+  def write(self, data):
+    "Send data to the child."
+    try:
+      self.process.stdin.write(data)
+      self.process.stdin.flush()
+    except IOError:
+      raise self.exited()
+
+  def read(self, size):
+    "Read size bytes of the child's answers."
+    data = self.process.stdout.read(size)
+    if len(data) < size:
+      raise self.exited()
+    return data
+
+  def exited(self):
+    "Return the error for a child that has exited."
+    return IOError("fork codec child %i exited (status %i)" % (
+      self.process.pid, self.stop()))
+
+  def control(self, data):
+    "Send a control message, and return the answer's first number."
+    self.write(data)
+    return struct.unpack("q", self.read(8))[0]
+
+  def attach_rings(self, size):
+    """
+    Make a shared memory file for two rings of size bytes, and have the
+    child map it too. Returns the (driver's, child's) Ring, or None if the
+    child couldn't map it.
+    """
+    shm_dir = os.path.isdir('/dev/shm') and '/dev/shm' or None
+    fd, path = tempfile.mkstemp(prefix='fork-codec-', dir=shm_dir)
+    try:
+      os.ftruncate(fd, 2 * size)
+      mapping = mmap.mmap(fd, 2 * size)
+      attached = self.control(struct.pack("qq", -1, len(path)) + path) == 0
+    finally:
+      os.close(fd)
+      os.unlink(path)
+    if not attached:
+      mapping.close()
+      return None
+    return Ring(mapping, 0, size), Ring(mapping, size, size)
+
+  def decode(self):
+    "Switch the child to decoding; returns whether it can."
+    return self.control(struct.pack("q", -3)) == 0
+
+  def send_one(self, data):
+    "Send a message by protocol 1, and return the answer."
+    self.write(data)
+    size = struct.unpack("q", self.read(8))[0]
+    return self.read(int(size))
+
+  def send(self, messages):
+    "Send a list of messages, and return the list of answers."
+    if self.protocol == 1:
+      return [self.send_one(data) for data in messages]
+    batch = pack_batch(messages)
+    offset = self.rings and self.rings[0].put(batch)
+    if offset is None:
+      self.write(batch)
+      outputs = []
+      for _ in messages:
+        size = struct.unpack("q", self.read(8))[0]
+        outputs.append(self.read(int(size)))
+      return outputs
+
+    self.write(struct.pack("qqq", -2, offset, len(batch)))
+    offset, size = struct.unpack("qq", self.read(16))
+    if offset == -1:
+      results, pos = self.read(size), 0
+    else:
+      results, pos = self.rings[1].mapping, self.rings[1].start + offset
+    outputs = []
+    for _ in messages:
+      size = struct.unpack_from("q", results, pos)[0]
+      outputs.append(results[pos + 8:pos + 8 + size])
+      pos += 8 + size
+    return outputs
+
+
+class Ring(object):
+  """
+  One side's ring buffer, in a shared memory map (see above). The reference
+  child (sample_exec_codec.py) has its own copy of this.
+  """
+  def __init__(self, mapping, start, size):
+    self.mapping = mapping
+    self.start = start
+    self.size = size
+    self.head = 0  # where the next write starts
+
+  def put(self, data):
+    "Write data to the ring, and return its offset, or None if it won't fit."
+    if len(data) > self.size:
+      return None
+    if self.head + len(data) > self.size:
+      self.head = 0
+    offset = self.head
+    start = self.start + offset
+    self.mapping[start:start + len(data)] = data
+    self.head += len(data)
+    return offset
+
+
+def format_header_list(headers):
+  "Return a header dictionary as a header list (see above)."
+  out = [struct.pack("q", len(headers))]
+  for name, value in headers.iteritems():
+    out.append(struct.pack("q", len(name)))
+    out.append(name)
+    out.append(struct.pack("q", len(value)))
+    out.append(value)
+  return ''.join(out)
+
+
+def parse_header_list(data):
+  "Return the header dictionary of a header list."
+  headers = {}
+  pos = 8
+  for _ in xrange(struct.unpack_from("q", data)[0]):
+    size = struct.unpack_from("q", data, pos)[0]
+    name = data[pos + 8:pos + 8 + size]
+    pos += 8 + size
+    size = struct.unpack_from("q", data, pos)[0]
+    headers[name] = data[pos + 8:pos + 8 + size]
+    pos += 8 + size
+  return headers
+
+
+DERIVED_FORMS['stripped_binary'] = lambda hdrs: \
+  format_header_list(stripped_headers(hdrs))
+
+
+def pack_batch(messages):
+  "Return a list of messages as a protocol 2 batch."
+  batch = [struct.pack("q", len(messages))]
+  for data in messages:
+    batch.append(struct.pack("q", len(data)))
+    batch.append(data)
+  return ''.join(batch)
+
+
+class Pool(object):
+  """
+  Protocol 2 children that compress at once (see above). Each message
+  goes to the same child as the others to its host.
+  """
+  def __init__(self, children, inflight):
+    self.workers = [Worker(index, child)
+                    for index, child in enumerate(children)]
+    self.inflight = inflight
+
+  def route(self, host):
+    "Return the index of the worker that compresses messages to host."
+    return (zlib.crc32(host) & 0xffffffff) % len(self.workers)
+
+  def send(self, assignments):
+    """
+    Send a list of (worker index, message), and return the list of
+    answers, in order.
+    """
+    answers = [None] * len(assignments)
+    for index, (worker, data) in enumerate(assignments):
+      self.workers[worker].queue.append((index, data))
+    poller = select.poll()
+    by_fd = {}
+    busy = 0
+    for worker in self.workers:
+      by_fd[worker.stdin] = by_fd[worker.stdout] = worker
+      if worker.start(self.inflight):
+        poller.register(worker.stdin, select.POLLOUT)
+        poller.register(worker.stdout, select.POLLIN)
+        busy += 1
+    while busy:
+      for fd, _ in poller.poll():
+        worker = by_fd[fd]
+        if fd == worker.stdin:
+          if worker.write():
+            poller.unregister(fd)
+        elif worker.read(answers):
+          if worker.start(self.inflight):
+            poller.register(worker.stdin, select.POLLOUT)
+          else:
+            poller.unregister(fd)
+            busy -= 1
+    return answers
+
+
+class Worker(object):
+  """
+  A pooled Child, the round of messages it's working on, and how it has
+  done: its messages, rounds and bytes each way, and the round trip time
+  of its rounds.
+  """
+  def __init__(self, index, child):
+    self.index = index
+    self.child = child
+    self.stdin = child.process.stdin.fileno()
+    self.stdout = child.process.stdout.fileno()
+    for fd in [self.stdin, self.stdout]:
+      fcntl.fcntl(fd, fcntl.F_SETFL,
+                  fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    self.queue = deque()  # (answer index, message) not yet sent
+    self.pending = deque()  # answer indices of the round, not yet answered
+    self.outgoing = ''  # the round's batch
+    self.written = 0  # of outgoing
+    self.incoming = bytearray()  # the round's answers read so far
+    self.parsed = 0  # of incoming, up to the first incomplete answer
+    self.started = 0.0  # when the round was started
+    self.messages = self.rounds = self.bytes_out = self.bytes_in = 0
+    self.round_trips = RunningStats()
+
+  def start(self, inflight):
+    """
+    Start a round of the next (at most inflight) queued messages; returns
+    False if there aren't any.
+    """
+    if not self.queue:
+      return False
+    messages = [self.queue.popleft()
+                for _ in range(min(inflight, len(self.queue)))]
+    self.pending.extend([index for index, _ in messages])
+    self.outgoing = pack_batch([data for _, data in messages])
+    self.written = 0
+    self.started = wall_clock()
+    return True
+
+  def write(self):
+    "Write what the pipe takes of the round; returns whether it's all sent."
+    try:
+      self.written += os.write(self.stdin,
+                               buffer(self.outgoing, self.written))
+    except OSError as oops:
+      if oops.errno != errno.EPIPE:
+        raise
+      raise self.child.exited()
+    return self.written == len(self.outgoing)
+
+  def read(self, answers):
+    """
+    Read what the pipe has, and put the answers it completes in answers;
+    returns whether the round has been answered.
+    """
+    data = os.read(self.stdout, 1 << 16)
+    if not data:
+      raise self.child.exited()
+    self.bytes_in += len(data)
+    incoming = self.incoming
+    incoming.extend(data)
+    pos = self.parsed
+    while self.pending and len(incoming) - pos >= 8:
+      size = struct.unpack_from("q", incoming, pos)[0]
+      if len(incoming) - pos < 8 + size:
+        break
+      answer = PooledAnswer(buffer(incoming, pos + 8, size))
+      answer.worker = self.index
+      answers[self.pending.popleft()] = answer
+      pos += 8 + size
+    self.parsed = pos
+    if self.pending:
+      return False
+    del incoming[:pos]
+    self.parsed = 0
+    self.messages += struct.unpack_from("q", self.outgoing)[0]
+    self.rounds += 1
+    self.bytes_out += len(self.outgoing)
+    self.round_trips.add(wall_clock() - self.started)
+    return True
+
+  def report(self):
+    "Return a line about how the worker has done."
+    return "worker %i: %i messages in %i rounds, %.2f MB out, %.2f MB in; " \
+      "round trip ms p50 %.3f p99 %.3f max %.3f" % (
+        self.index, self.messages, self.rounds, self.bytes_out / 2.0 ** 20,
+        self.bytes_in / 2.0 ** 20,
+        self.round_trips.quantile(0.5) * 1000,
+        self.round_trips.quantile(0.99) * 1000,
+        (self.round_trips.max or 0) * 1000)
+
+
+class PooledAnswer(str):
+  """
+  A pooled child's answer, with the index of the child (worker) that made
+  it, which is kept when it's pickled for --verify=async.
+  """
+  worker = None
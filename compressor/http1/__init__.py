@@ -2,11 +2,14 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-from .. import BaseProcessor, spdy_dictionary, format_http1, parse_http1
+from .. import BaseProcessor, spdy_dictionary, http1_text, parse_http1
 
 class Processor(BaseProcessor):
+  stateful_decompress = False
+  forms = ['http1']
+
   def compress(self, in_headers, host):
-    return format_http1(in_headers)
+    return http1_text(in_headers)
 
   def decompress(self, compressed):
     return parse_http1(compressed)
\ No newline at end of file
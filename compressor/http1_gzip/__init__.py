@@ -3,18 +3,21 @@
 # found in the LICENSE file.
 
 import zlib
-from .. import BaseProcessor, spdy_dictionary, format_http1, parse_http1
+from .. import BaseProcessor, spdy_dictionary, http1_text, parse_http1
 
 class Processor(BaseProcessor):
+  forms = ['http1']
+
   def __init__(self, options, is_request, params):
     BaseProcessor.__init__(self, options, is_request, params)
-    self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
-                                       zlib.DEFLATED, 15)
+    self.compressor = zlib.compressobj(
+      self.param('level', zlib.Z_DEFAULT_COMPRESSION), zlib.DEFLATED,
+      self.param('window', 15))
     self.compressor.compress(spdy_dictionary.spdy_dict);
     self.compressor.flush(zlib.Z_SYNC_FLUSH)
 
   def compress(self, in_headers, host):
-    http1_msg = format_http1(in_headers)
+    http1_msg = http1_text(in_headers)
     return ''.join([
                    self.compressor.compress(http1_msg),
                    self.compressor.flush(zlib.Z_SYNC_FLUSH)
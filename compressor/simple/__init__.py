@@ -1,7 +1,7 @@
 
 # pylint: disable=W0311
 
-from .. import BaseProcessor, strip_conn_headers, format_http1, parse_http1
+from .. import BaseProcessor, stripped_headers, format_http1, parse_http1
 from collections import defaultdict
 import re
 import calendar
@@ -62,6 +62,8 @@ class Processor(BaseProcessor):
     'date',
     'expires'
   ]
+
+  forms = ['stripped']
   
   def __init__(self, options, is_request, params):
     BaseProcessor.__init__(self, options, is_request, params)
@@ -73,7 +75,7 @@ class Processor(BaseProcessor):
   def compress(self, in_headers, host):
     headers = {}
     refs = []
-    for name, value in strip_conn_headers(in_headers).items():
+    for name, value in stripped_headers(in_headers).items():
       if name in self.date_hdrs:
         try:
           headers[self.hdr_name(name)] = "%x" % parse_date(value)
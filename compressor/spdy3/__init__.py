@@ -4,25 +4,30 @@
 
 import zlib
 import struct
-from .. import spdy_dictionary, BaseProcessor, strip_conn_headers
+from .. import spdy_dictionary, BaseProcessor, DERIVED_FORMS, derived
+from .. import stripped_headers
 
 class Processor(BaseProcessor):
+  forms = ['spdy3_frame']
+
   def __init__(self, options, is_request, params):
     BaseProcessor.__init__(self, options, is_request, params)
-    self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
-                                       zlib.DEFLATED, 15)
+    self.compressor = zlib.compressobj(
+      self.param('level', zlib.Z_DEFAULT_COMPRESSION), zlib.DEFLATED,
+      self.param('window', 15))
     self.compressor.compress(spdy_dictionary.spdy_dict);
     self.compressor.flush(zlib.Z_SYNC_FLUSH)
 
   def compress(self, in_headers, host):
-    raw_spdy3_frame = self.Spdy3HeadersFormat(strip_conn_headers(in_headers))
+    raw_spdy3_frame = derived(in_headers, 'spdy3_frame')
     compress_me_payload = raw_spdy3_frame[12:]
     final_frame = raw_spdy3_frame[:12]
     final_frame += self.compressor.compress(compress_me_payload)
     final_frame += self.compressor.flush(zlib.Z_SYNC_FLUSH)
     return final_frame
 
-  def Spdy3HeadersFormat(self, request):
+  @staticmethod
+  def Spdy3HeadersFormat(request):
     """
     Formats the provided headers in SPDY3 format, uncompressed
     """
@@ -46,3 +51,6 @@ class Processor(BaseProcessor):
       out_frame.append(val)
     return ''.join(out_frame)
 
+
+DERIVED_FORMS['spdy3_frame'] = lambda hdrs: \
+  Processor.Spdy3HeadersFormat(stripped_headers(hdrs))
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+
+"""
+Compact corpora of header messages: in memory, or in a file that's mapped
+into memory, so that processes can share it.
+
+Run as a script, this exports HAR files to a corpus file:
+
+  ./corpus.py -o corpus.hdrc *.har
+
+A corpus file holds, with all integers little-endian:
+
+  header         magic "ctcorp01", uint32 number of strings, messages and
+                 header indices (two per header), a zero uint32 and the
+                 uint64 size of the string heap;
+  string ends    uint64 per string: where it ends in the heap (and the
+                 next string starts), after a zero;
+  message ends   uint32 per message: where its headers end in the header
+                 indices (and the next message's start), after a zero;
+  types          uint8 per message: 0 for a request, 1 for a response;
+  hosts          uint32 per message: the string index of its host;
+  headers        uint32 name and value string indices of each header;
+  heap           the bytes of every distinct header name and value.
+
+Each section is padded with zeros to a multiple of 8 bytes. Headers are
+in the order they were added (see harfile.entry2items()).
+"""
+
+# pylint: disable=W0311
+
+from array import array
+from itertools import groupby
+import mmap
+import optparse
+import shutil
+import struct
+import sys
+import tempfile
+
+import harfile
+from sampling import Deduplicator
+
+CORPUS_MAGIC = 'ctcorp01'
+CORPUS_HEADER = struct.Struct('<8sIIIIQ')
+MSG_TYPES = ('req', 'res')  # message types, in the order of their numbers
+CORPUS_SECTIONS = ['string_ends', 'starts', 'types', 'hosts', 'headers',
+                   'heap']
+
+
+class Corpus(object):
+  """
+  Header messages, with their types and hosts, held compactly: each
+  distinct header name and value is kept once in a table of strings, and a
+  message is just a run of (name, value) indices into it.
+
+  Messages are kept in the order their headers were added (as by
+  harfile.entry2items()), so that dict(corpus.message(n)) is just like the
+  dictionary they were parsed into.
+  """
+  def __init__(self):
+    self.strings = []  # index -> string
+    self.string_ids = {}  # string -> index
+    self.headers = array('I')  # name, value, name, value, ... of all
+    self.starts = array('I', [0])  # message -> start in headers
+    self.types = array('B')  # message -> index into MSG_TYPES
+    self.hosts = array('I')  # message -> index of host in strings
+
+  def intern(self, string):
+    "Return the index of string in the string table, adding it if needed."
+    try:
+      return self.string_ids[string]
+    except KeyError:
+      index = self.string_ids[string] = len(self.strings)
+      self.strings.append(string)
+      return index
+
+  def add(self, msg_type, items, host):
+    "Add a message of msg_type, given as a list of (name, value)."
+    intern = self.intern
+    for name, value in items:
+      self.headers.append(intern(name))
+      self.headers.append(intern(value))
+    self.starts.append(len(self.headers))
+    self.types.append(MSG_TYPES.index(msg_type))
+    self.hosts.append(intern(host))
+
+  def __len__(self):
+    return len(self.types)
+
+  def iteritems(self, index):
+    "Generate the (name, value) of each header in message index."
+    strings = self.strings
+    headers = self.headers
+    for pos in xrange(self.starts[index], self.starts[index + 1], 2):
+      yield strings[headers[pos]], strings[headers[pos + 1]]
+
+  def num_headers(self, index):
+    "Return the number of headers in message index."
+    return (self.starts[index + 1] - self.starts[index]) // 2
+
+  def message(self, index):
+    "Return (message_type, HeaderView, host) for message index."
+    return (MSG_TYPES[self.types[index]], HeaderView(self, index),
+            self.strings[self.hosts[index]])
+
+  def __iter__(self):
+    "Generate (message_type, HeaderView, host) for each message."
+    for index in xrange(len(self)):
+      yield self.message(index)
+
+  def write(self, filename):
+    "Write the corpus to a corpus file."
+    heap = ''.join(self.strings)
+    ends = [0]
+    for string in self.strings:
+      ends.append(ends[-1] + len(string))
+    sections = [
+      CORPUS_HEADER.pack(CORPUS_MAGIC, len(self.strings), len(self),
+                         len(self.headers), 0, len(heap)),
+      struct.pack('<%iQ' % len(ends), *ends),
+      little_endian(self.starts),
+      self.types.tostring(),
+      little_endian(self.hosts),
+      little_endian(self.headers),
+      heap,
+    ]
+    cfh = open(filename, 'wb')
+    try:
+      for section in sections:
+        cfh.write(section)
+        cfh.write('\0' * (-len(section) % 8))
+    finally:
+      cfh.close()
+
+
+class CorpusWriter(object):
+  """
+  Writes a corpus file one message at a time, for corpora too big to hold
+  in memory. The sections are spooled to temporary files and joined by
+  close().
+
+  Strings are interned as by Corpus, but only the last max_interned of
+  them are remembered, so a string may be stored more than once.
+  """
+  def __init__(self, filename, max_interned=1 << 20, flush_size=1 << 16):
+    self.filename = filename
+    self.max_interned = max_interned
+    self.flush_size = flush_size
+    self.string_ids = {}  # string -> index, for recent strings
+    self.num_strings = 0
+    self.num_messages = 0
+    self.num_indices = 0
+    self.heap_size = 0
+    self.ends = [0]  # string ends not yet spooled
+    self.strings = []  # strings not yet spooled
+    self.headers = array('I')
+    self.starts = array('I', [0])
+    self.types = array('B')
+    self.hosts = array('I')
+    self.spools = dict([(section, tempfile.TemporaryFile())
+                        for section in CORPUS_SECTIONS])
+
+  def intern(self, string):
+    "Return the index of string in the string table, adding it if needed."
+    try:
+      return self.string_ids[string]
+    except KeyError:
+      if len(self.string_ids) >= self.max_interned:
+        self.string_ids.clear()
+      index = self.string_ids[string] = self.num_strings
+      self.num_strings += 1
+      self.heap_size += len(string)
+      self.ends.append(self.heap_size)
+      self.strings.append(string)
+      return index
+
+  def add(self, msg_type, items, host):
+    "Add a message of msg_type, given as a list of (name, value)."
+    intern = self.intern
+    indices = []
+    for name, value in items:
+      indices.append(intern(name))
+      indices.append(intern(value))
+    host = intern(host)
+    # checked before the arrays of 32-bit integers overflow
+    if self.num_indices + len(indices) >= 1 << 32 or \
+        self.num_strings >= 1 << 32:
+      raise ValueError("%s is too big for a corpus file" % self.filename)
+    self.headers.extend(indices)
+    self.num_indices += len(indices)
+    self.starts.append(self.num_indices)
+    self.types.append(MSG_TYPES.index(msg_type))
+    self.hosts.append(host)
+    self.num_messages += 1
+    if len(self.headers) >= self.flush_size:
+      self.flush()
+
+  def __len__(self):
+    return self.num_messages
+
+  def flush(self):
+    "Move what's been added to the spool files."
+    spools = self.spools
+    spools['string_ends'].write(struct.pack('<%iQ' % len(self.ends),
+                                            *self.ends))
+    spools['heap'].write(''.join(self.strings))
+    for section in ['headers', 'starts', 'types', 'hosts']:
+      integers = getattr(self, section)
+      spools[section].write(little_endian(integers))
+      del integers[:]
+    del self.ends[:]
+    del self.strings[:]
+
+  def close(self):
+    "Write the corpus file."
+    self.flush()
+    cfh = open(self.filename, 'wb')
+    try:
+      cfh.write(CORPUS_HEADER.pack(CORPUS_MAGIC, self.num_strings,
+                                   self.num_messages, self.num_indices, 0,
+                                   self.heap_size))
+      for section in CORPUS_SECTIONS:
+        spool = self.spools[section]
+        size = spool.tell()
+        spool.seek(0)
+        shutil.copyfileobj(spool, cfh)
+        spool.close()
+        cfh.write('\0' * (-size % 8))
+    finally:
+      cfh.close()
+
+
+class MappedCorpus(object):
+  """
+  A corpus file, mapped read-only into memory. Messages are read from it
+  as they're used, so processes using the same file share its pages.
+
+  Each string is copied out of the map as it's read, rather than handed
+  out as a buffer(): codecs need str, and in Python 2 a buffer neither
+  compares equal to nor hashes like the str it holds.
+  """
+  def __init__(self, filename):
+    fhandle = open(filename, 'rb')
+    try:
+      self.map = mmap.mmap(fhandle.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+      fhandle.close()
+    try:
+      self.read_header(filename)
+    except ValueError:
+      self.map.close()
+      raise
+
+  def read_header(self, filename):
+    "Read the counts, and find the sections."
+    if self.map[:len(CORPUS_MAGIC)] != CORPUS_MAGIC:
+      raise ValueError("%s isn't a corpus file" % filename)
+    if len(self.map) < CORPUS_HEADER.size:
+      raise ValueError("%s is truncated" % filename)
+    (_, self.num_strings, self.num_messages, num_indices, _,
+     heap_size) = CORPUS_HEADER.unpack_from(self.map)
+    offset = CORPUS_HEADER.size
+    self.offsets = {}
+    for section, size in [('string_ends', 8 * (self.num_strings + 1)),
+                          ('starts', 4 * (self.num_messages + 1)),
+                          ('types', self.num_messages),
+                          ('hosts', 4 * self.num_messages),
+                          ('headers', 4 * num_indices),
+                          ('heap', heap_size)]:
+      self.offsets[section] = offset
+      offset += size + (-size % 8)
+    if offset > len(self.map):
+      raise ValueError("%s is truncated" % filename)
+
+  def close(self):
+    "Unmap the file."
+    self.map.close()
+
+  def string(self, index):
+    "Return string index from the heap."
+    start, end = struct.unpack_from(
+      '<QQ', self.map, self.offsets['string_ends'] + 8 * index)
+    heap = self.offsets['heap']
+    return self.map[heap + start:heap + end]
+
+  def iteritems(self, index):
+    "Generate the (name, value) of each header in message index."
+    start, end = struct.unpack_from(
+      '<II', self.map, self.offsets['starts'] + 4 * index)
+    indices = struct.unpack_from(
+      '<%iI' % (end - start), self.map, self.offsets['headers'] + 4 * start)
+    string = self.string
+    for pos in xrange(0, len(indices), 2):
+      yield string(indices[pos]), string(indices[pos + 1])
+
+  def num_headers(self, index):
+    "Return the number of headers in message index."
+    start, end = struct.unpack_from(
+      '<II', self.map, self.offsets['starts'] + 4 * index)
+    return (end - start) // 2
+
+  def __len__(self):
+    return self.num_messages
+
+  def message(self, index):
+    "Return (message_type, HeaderView, host) for message index."
+    msg_type = ord(self.map[self.offsets['types'] + index])
+    host, = struct.unpack_from('<I', self.map,
+                               self.offsets['hosts'] + 4 * index)
+    return (MSG_TYPES[msg_type], HeaderView(self, index), self.string(host))
+
+  def __iter__(self):
+    "Generate (message_type, HeaderView, host) for each message."
+    for index in xrange(len(self)):
+      yield self.message(index)
+
+
+class HeaderView(object):
+  """
+  A read-only view of a message in a corpus, which can be used like a
+  header dictionary. It iterates in the order headers were added; dict()
+  of it makes the dictionary that the message was parsed into.
+  """
+  __slots__ = ['corpus', 'index']
+
+  def __init__(self, corpus, index):
+    self.corpus = corpus
+    self.index = index
+
+  def iteritems(self):
+    "Generate the (name, value) of each header."
+    return self.corpus.iteritems(self.index)
+
+  def items(self):
+    "Return a list of the (name, value) of each header."
+    return list(self.iteritems())
+
+  def iterkeys(self):
+    "Generate the name of each header."
+    for name, _ in self.iteritems():
+      yield name
+  __iter__ = iterkeys
+
+  def keys(self):
+    "Return a list of the header names."
+    return list(self.iterkeys())
+
+  def itervalues(self):
+    "Generate the value of each header."
+    for _, value in self.iteritems():
+      yield value
+
+  def values(self):
+    "Return a list of the header values."
+    return list(self.itervalues())
+
+  def get(self, key, default=None):
+    "Return the value of header key, or default."
+    for name, value in self.iteritems():
+      if name == key:
+        return value
+    return default
+
+  def __getitem__(self, key):
+    value = self.get(key, self)
+    if value is self:
+      raise KeyError(key)
+    return value
+
+  def __contains__(self, key):
+    return self.get(key, self) is not self
+  has_key = __contains__
+
+  def __len__(self):
+    return self.corpus.num_headers(self.index)
+
+
+def little_endian(integers):
+  "Return the bytes of an array of integers, little-endian."
+  if sys.byteorder == 'big':
+    integers = array(integers.typecode, integers)
+    integers.byteswap()
+  return integers.tostring()
+
+
+def is_corpus_file(filename):
+  "Return whether filename is a corpus file (rather than a HAR file)."
+  fhandle = open(filename, 'rb')
+  try:
+    return fhandle.read(len(CORPUS_MAGIC)) == CORPUS_MAGIC
+  finally:
+    fhandle.close()
+
+
+def iter_files(filenames, jobs=1, read_items=harfile.iter_input_items):
+  """
+  Generate (filename, messages) for HAR and corpus files, in order, where
+  messages generates (message_type, header items, host) for the file's
+  messages. HAR files are read by harfile.iter_har_files(), with jobs and
+  read_items.
+  """
+  for is_corpus, group in groupby(filenames, is_corpus_file):
+    if is_corpus:
+      for filename in group:
+        yield filename, iter_mapped_items(filename)
+      continue
+    for filename, entries in harfile.iter_har_files(group, jobs, read_items,
+                                                    as_items=True):
+      yield filename, iter_entry_items(entries)
+
+
+def iter_mapped_items(filename):
+  "Generate (message_type, header items, host) from a corpus file."
+  mapped = MappedCorpus(filename)
+  try:
+    for message_type, message, host in mapped:
+      yield message_type, message.items(), host
+  finally:
+    mapped.close()
+
+
+def iter_entry_items(entries):
+  "Generate (message_type, header items, host) from HAR entry items."
+  for req_items, res_items in entries:
+    host = dict(req_items)[':host']
+    yield 'req', req_items, host
+    yield 'res', res_items, host
+
+
+def iter_items(filenames, jobs=1, read_items=harfile.iter_input_items):
+  """
+  Generate (message_type, header items, host) for the messages in HAR and
+  corpus files, in order, as iter_files() reads them.
+  """
+  for _, messages in iter_files(filenames, jobs, read_items):
+    for message in messages:
+      yield message
+
+
+def main():
+  "Export HAR files to a corpus file."
+  optp = optparse.OptionParser(
+    usage="%prog [options] -o CORPUS_FILE har-or-corpus-files")
+  optp.add_option('-o', '--output',
+                  dest='output',
+                  help='corpus file to write',
+                  metavar='FILE')
+  optp.add_option('-j', '--jobs',
+                  type='int',
+                  dest='jobs',
+                  help='parse HAR files in this many worker processes '
+                  '(default: %default)',
+                  default=1,
+                  metavar='N')
+  optp.add_option('--dedup',
+                  action="store_true",
+                  dest="dedup",
+                  help="leave out messages that are exact duplicates of "
+                  "earlier ones.",
+                  default=False)
+  options, args = optp.parse_args()
+  if not options.output or not args:
+    optp.error("need an output file and some input files")
+  try:
+    args = harfile.expand_paths(args)
+  except ValueError as oops:
+    optp.error(str(oops))
+  writer = CorpusWriter(options.output)
+  messages = iter_items(args, options.jobs)
+  if options.dedup:
+    messages = Deduplicator().unique(messages)
+  for message_type, items, host in messages:
+    writer.add(message_type, items, host)
+  writer.close()
+  sys.stderr.write("Wrote %i messages (%i strings) to %s.\n" % (
+    len(writer), writer.num_strings, options.output))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# pylint: disable=W0311
+
+import json
+import os
+import random
+import shutil
+import tempfile
+
+import corpus
+import harfile
+
+
+def Check(what, value, expected):
+  if value != expected:
+    print "Failure!: %s is %r; expected %r" % (what, value, expected)
+    raise StandardError()
+
+
+def CheckRaises(what, message, func, *args):
+  try:
+    func(*args)
+  except ValueError as oops:
+    Check("%s error" % what, str(oops), message)
+    return
+  print "Failure!: %s didn't raise ValueError" % what
+  raise StandardError()
+
+
+def make_messages(count, seed=1):
+  "Return a list of (message_type, header items, host)."
+  rand = random.Random(seed)
+  values = ['', '\0', '\xff\xfe', 'gzip, deflate', 'a' * 1000, '*/*']
+  messages = []
+  for number in range(count):
+    items = [(rand.choice(['accept', 'cookie', ':path', 'x-%i' % number]),
+              rand.choice(values + [str(number)]))
+             for _ in range(rand.randint(0, 8))]
+    messages.append((corpus.MSG_TYPES[number % 2], items,
+                     'host%i.example.com' % rand.randint(0, 3)))
+  return messages
+
+
+def read_corpus(filename):
+  "Return the messages of a corpus file, as iter_items() generates them."
+  return list(corpus.iter_items([filename]))
+
+
+def check_round_trips(directory, messages):
+  "Messages written by Corpus and CorpusWriter must read back unchanged."
+  filename = os.path.join(directory, 'a.hdrc')
+  in_memory = corpus.Corpus()
+  for message in messages:
+    in_memory.add(*message)
+  Check("messages in memory", [(msg_type, message.items(), host)
+                               for msg_type, message, host in in_memory],
+        messages)
+  in_memory.write(filename)
+  Check("messages written by Corpus", read_corpus(filename), messages)
+  mapped = corpus.MappedCorpus(filename)
+  msg_type, message, host = mapped.message(3)
+  Check("message length", len(message), len(messages[3][1]))
+  Check("message dictionary", dict(message), dict(messages[3][1]))
+  mapped.close()
+
+  # forgetting strings, and spooling, as a big corpus would
+  for max_interned, flush_size in [(1 << 20, 1 << 16), (2, 4), (1, 1)]:
+    writer = corpus.CorpusWriter(filename, max_interned, flush_size)
+    for message in messages:
+      writer.add(*message)
+    writer.close()
+    Check("messages written by CorpusWriter(%i, %i)" % (
+      max_interned, flush_size), read_corpus(filename), messages)
+
+  writer = corpus.CorpusWriter(filename)
+  writer.close()
+  Check("empty corpus", read_corpus(filename), [])
+
+
+def check_mixed_input(directory, messages):
+  "Corpus and HAR files must be read in the order they're given."
+  filename = os.path.join(directory, 'b.hdrc')
+  in_memory = corpus.Corpus()
+  for message in messages:
+    in_memory.add(*message)
+  in_memory.write(filename)
+  har_name = os.path.join(directory, 'c.har')
+  hfh = open(har_name, 'w')
+  json.dump({"log": {"entries": [{
+    "request": {"method": "GET", "url": "http://example.com/",
+                "httpVersion": "HTTP/1.1",
+                "headers": [{"name": "Host", "value": "example.com"}]},
+    "response": {"status": 200, "statusText": "OK",
+                 "httpVersion": "HTTP/1.1", "headers": []}}]}}, hfh)
+  hfh.close()
+  har_messages = list(corpus.iter_entry_items(
+    harfile.iter_input_items(har_name)))
+  Check("HAR messages", len(har_messages), 2)
+  for jobs in [1, 2]:
+    Check("messages of mixed files, with %i jobs" % jobs,
+          list(corpus.iter_items([filename, har_name, filename], jobs)),
+          messages + har_messages + messages)
+
+
+def check_errors(directory, messages):
+  "Bad files, and corpora too big for the format, must be refused."
+  filename = os.path.join(directory, 'd.hdrc')
+  in_memory = corpus.Corpus()
+  for message in messages:
+    in_memory.add(*message)
+  in_memory.write(filename)
+  cfh = open(filename, 'rb')
+  data = cfh.read()
+  cfh.close()
+  for size in [len(data) - 8, corpus.CORPUS_HEADER.size + 8,
+               corpus.CORPUS_HEADER.size - 1, len(corpus.CORPUS_MAGIC)]:
+    cfh = open(filename, 'wb')
+    cfh.write(data[:size])
+    cfh.close()
+    CheckRaises("%i bytes of a corpus" % size, "%s is truncated" % filename,
+                corpus.MappedCorpus, filename)
+    CheckRaises("reading %i bytes of a corpus" % size,
+                "%s is truncated" % filename, read_corpus, filename)
+  cfh = open(filename, 'wb')
+  cfh.write('{"log": {"entries": []}}')
+  cfh.close()
+  CheckRaises("a HAR file", "%s isn't a corpus file" % filename,
+              corpus.MappedCorpus, filename)
+
+  writer = corpus.CorpusWriter(filename)
+  writer.add(*messages[0])
+  writer.num_indices = (1 << 32) - 2
+  writer.add('req', [], 'example.com')
+  CheckRaises("too many header indices", "%s is too big for a corpus file"
+              % filename, writer.add, 'req', [('a', 'b')], 'example.com')
+  Check("messages after too many indices", len(writer), 2)
+  writer.num_strings = 1 << 32
+  CheckRaises("too many strings", "%s is too big for a corpus file"
+              % filename, writer.add, 'req', [], 'example.com')
+  Check("messages after too many strings", len(writer), 2)
+
+
+def main():
+  messages = make_messages(500)
+  directory = tempfile.mkdtemp()
+  try:
+    check_round_trips(directory, messages)
+    check_mixed_input(directory, messages)
+    check_errors(directory, messages)
+  finally:
+    shutil.rmtree(directory)
+  print "Success!"
+
+
+main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+# pylint: disable=W0311
+
+from collections import OrderedDict
+import mmap
+import optparse
+import os
+import pickle
+import shutil
+import struct
+import sys
+import tempfile
+
+from compressor import fork, parse_http1, prepare
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CODEC = os.path.join(HERE, 'sample_exec_codec.py')
+
+# a child that speaks protocol 1, and exits after answering two messages
+DYING_CODEC = """#!%s
+import struct, sys
+for _ in range(2):
+  lines = [sys.stdin.readline()]
+  while lines[-1] not in ('\\r\\n', '\\n', ''):
+    lines.append(sys.stdin.readline())
+  data = ''.join(lines)
+  sys.stdout.write(struct.pack("q", len(data)) + data)
+  sys.stdout.flush()
+sys.exit(3)
+"""
+
+# a protocol 2 child that logs its pid, and can only decode while there are
+# at most four of it
+FUSSY_CODEC = """#!%s
+import os, struct, sys
+PIDS = %r
+pids = open(PIDS, 'a')
+pids.write('%%i\\n' %% os.getpid())
+pids.close()
+def read_number():
+  data = sys.stdin.read(8)
+  if len(data) < 8:
+    sys.exit(0)
+  return struct.unpack("q", data)[0]
+def write(data):
+  sys.stdout.write(data)
+  sys.stdout.flush()
+while sys.stdin.readline() not in ('\\r\\n', '\\n', ''):
+  pass
+write(struct.pack("q", 21) + 'fork-codec protocol:2')
+while True:
+  count = read_number()
+  if count == -3:
+    write(struct.pack("q", len(open(PIDS).readlines()) > 4))
+    continue
+  out = []
+  for _ in range(count):
+    data = sys.stdin.read(read_number())
+    out.append(struct.pack("q", len(data)) + data)
+  write(''.join(out))
+"""
+
+
+def Check(what, value, expected):
+  if value != expected:
+    print "Failure!: %s is %r; expected %r" % (what, value, expected)
+    raise StandardError()
+
+
+def CheckRaises(what, exception, message, func, *args):
+  try:
+    func(*args)
+  except exception as oops:
+    if message is not None:
+      Check("%s error" % what, str(oops), message)
+    return
+  print "Failure!: %s didn't raise %s" % (what, exception.__name__)
+  raise StandardError()
+
+
+def make_messages(count):
+  "Return a list of (request headers, host)."
+  messages = []
+  for number in range(count):
+    host = 'host%i.example.com' % (number % 7)
+    headers = {':method': 'GET', ':path': '/%i?q=%s' % (number, 'x' * number),
+               ':version': 'HTTP/1.1', ':scheme': 'http', ':host': host,
+               'accept': '*/*', 'cookie': 'a=%i\0b=2' % number,
+               'connection': 'keep-alive'}
+    if number % 3:
+      headers['x-number'] = str(number)
+    messages.append((headers, host))
+  return messages
+
+
+def check_formats():
+  "Header lists and batches must be made as compressor/fork describes."
+  headers = OrderedDict([('b', '\0\r\n: '), ('', ''), (':a', 'x' * 300),
+                         ('c', '')])
+  data = fork.format_header_list(headers)
+  Check("header list", data, struct.pack("q", 4) + ''.join([
+    struct.pack("q", len(name)) + name + struct.pack("q", len(value)) + value
+    for name, value in headers.items()]))
+  Check("parsed header list", fork.parse_header_list(data), dict(headers))
+  Check("empty header list", fork.parse_header_list(
+    fork.format_header_list({})), {})
+  message = prepare(make_messages(1)[0][0])
+  Check("derived header list", fork.parse_header_list(
+    fork.DERIVED_FORMS['stripped_binary'](message)),
+        dict([item for item in message.items() if item[0] != 'connection']))
+
+  messages = ['', 'a', '\0' * 9, 'xyz' * 100]
+  batch = fork.pack_batch(messages)
+  Check("batch size", struct.unpack_from("q", batch)[0], len(messages))
+  pos, unpacked = 8, []
+  for _ in messages:
+    size = struct.unpack_from("q", batch, pos)[0]
+    unpacked.append(batch[pos + 8:pos + 8 + size])
+    pos += 8 + size
+  Check("batch", (unpacked, pos), (messages, len(batch)))
+  Check("empty batch", fork.pack_batch([]), struct.pack("q", 0))
+
+  mapping = mmap.mmap(-1, 64)
+  ring = fork.Ring(mapping, 16, 32)
+  Check("ring offsets", [ring.put(data) for data in ['a' * 20, 'b' * 10,
+                                                      'c' * 5, 'd' * 33]],
+        [0, 20, 0, None])
+  Check("ring", mapping[:], '\0' * 16 + 'c' * 5 + 'a' * 15 + 'b' * 10 +
+        '\0' * 18)
+
+
+def run_codec(params, messages, batch_size=16, verify='all', path=CODEC):
+  """
+  Compress messages with a fork codec, and decompress them. Returns the
+  processor, and the lists of compressed and decompressed messages.
+  """
+  options = optparse.Values({'verify': verify})
+  processor = fork.Processor(options, True, [path] + params)
+  compressed = []
+  for start in range(0, len(messages), batch_size):
+    compressed.extend(processor.compress_batch([
+      (prepare(headers, processor.forms), host)
+      for headers, host in messages[start:start + batch_size]]))
+  if verify in ('off', 'async'):
+    return processor, compressed, None
+  return processor, compressed, [processor.decompress(data)
+                                 for data in compressed]
+
+
+def check_codec(params, messages):
+  "A run of the sample codec with params must give back the messages."
+  processor, compressed, decompressed = run_codec(params, messages)
+  binary = 'format:binary' in params
+  Check("%s: message form" % params, processor.forms,
+        [binary and 'stripped_binary' or 'stripped_http1'])
+  for headers, data in zip([prepare(headers) for headers, _ in messages],
+                           compressed):
+    Check("%s: compressed" % params, data,
+          fork.derived(headers, processor.forms[0]))
+  for (headers, _), result in zip(messages, decompressed):
+    expected = dict(headers)
+    del expected['connection']
+    if not binary:
+      expected[':scheme'] = parse_http1(
+        fork.derived(headers, 'stripped_http1'))[':scheme']
+    Check("%s: decompressed" % params, result, expected)
+  return processor
+
+
+def check_driver(directory):
+  "Drive the sample codec through each transport, format and pool."
+  messages = make_messages(100)
+  processor, _, _ = run_codec([], messages[:4], verify='off')
+  Check("default protocol", processor.encoder.protocol, 1)
+  CheckRaises("decompressing by protocol 1", NotImplementedError, None,
+              run_codec, [], messages[:4])
+
+  for params in [['protocol:2'], ['transport:shm'], ['format:binary'],
+                 ['transport:shm', 'shm_kb:1', 'format:binary'],
+                 ['workers:3'], ['workers:3', 'inflight:2', 'format:binary']]:
+    processor = check_codec(params, messages)
+    Check("%s: protocol" % params, processor.encoder.protocol, 2)
+    Check("%s: shared memory" % params, processor.encoder.rings is not None,
+          'transport:shm' in params)
+    Check("%s: header lists" % params, processor.encoder.binary,
+          'format:binary' in params)
+    reports = processor.report()
+    Check("%s: workers reported" % params, len(reports),
+          'workers:3' in params and 3 or 0)
+    Check("%s: messages reported" % params,
+          sum([int(line.split()[2]) for line in reports]),
+          reports and len(messages) or 0)
+
+  # pooled answers go to their child's decoder, wherever they're decoded
+  processor, compressed, _ = run_codec(['workers:3'], messages,
+                                       verify='async')
+  Check("decoders with --verify=async", processor.decoders, None)
+  Check("workers of answers", [data.worker for data in compressed],
+        [processor.pool.route(host) for _, host in messages])
+  compressed = [pickle.loads(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+                for data in compressed]
+  Check("workers of pickled answers", [data.worker for data in compressed],
+        [processor.pool.route(host) for _, host in messages])
+  verifier = fork.Processor(optparse.Values({'verify': 'all'}), True,
+                            [CODEC, 'workers:3'])
+  Check("answers decoded elsewhere",
+        [verifier.decompress(data) for data in compressed[::-1]],
+        [verifier.parse(fork.derived(prepare(headers), 'stripped_http1'))
+         for headers, _ in messages[::-1]])
+  CheckRaises("decoding an answer from no worker", NotImplementedError, None,
+              verifier.decompress, str(compressed[0]))
+
+  # decoders are stopped when one of them can't decode
+  path = os.path.join(directory, 'fussy_codec.py')
+  pids_path = os.path.join(directory, 'pids')
+  cfh = open(path, 'w')
+  cfh.write(FUSSY_CODEC % (sys.executable, pids_path))
+  cfh.close()
+  os.chmod(path, 0755)
+  processor, _, _ = run_codec(['workers:3'], messages[:10], verify='off',
+                              path=path)
+  Check("decoders with --verify=off", processor.decoders, None)
+  os.remove(pids_path)
+  processor = fork.Processor(optparse.Values({'verify': 'all'}), True,
+                             [path, 'workers:3'])
+  Check("decoders when one can't decode", processor.decoders, None)
+  pids = [int(line) for line in open(pids_path)]
+  Check("children started", len(pids), 5)
+  for pid in pids[3:]:
+    CheckRaises("signalling decoder %i" % pid, OSError, None, os.kill, pid, 0)
+
+  path = os.path.join(directory, 'dying_codec.py')
+  cfh = open(path, 'w')
+  cfh.write(DYING_CODEC % sys.executable)
+  cfh.close()
+  os.chmod(path, 0755)
+  for params in [[], ['protocol:2']]:
+    processor = fork.Processor(optparse.Values({'verify': 'off'}), True,
+                               [path] + params)
+    Check("%s: protocol of a protocol 1 child" % params,
+          processor.encoder.protocol, 1)
+    messages = [(prepare(headers), host)
+                for headers, host in make_messages(3)]
+    Check("%s: answers" % params, processor.compress_batch(messages[:2]),
+          [fork.derived(headers, 'stripped_http1')
+           for headers, _ in messages[:2]])
+    CheckRaises("%s: a child that exits" % params, IOError,
+                "fork codec child %i exited (status 3)" %
+                processor.encoder.process.pid,
+                processor.compress_batch, messages[2:])
+
+
+def main():
+  check_formats()
+  directory = tempfile.mkdtemp()
+  try:
+    check_driver(directory)
+  finally:
+    shutil.rmtree(directory)
+  print "Success!"
+
+
+main()
@@ -1,7 +1,8 @@
 #!/usr/bin/python
 
 """
-Utilities to get harfiles into the shape we want them to be.
+Utilities to get harfiles (and other header logs) into the shape we want
+them to be.
 """
 
 # Copyright (c) 2012 The Chromium Authors. All rights reserved.
@@ -10,24 +11,711 @@ Utilities to get harfiles into the shape we want them to be.
 
 # pylint: disable=W0311
 
+import bz2
+import calendar
+from collections import OrderedDict, deque
+import glob
+import gzip
+import hashlib
+import heapq
+import marshal
+import multiprocessing
+import os
 import re
 import json
+import subprocess
 import sys
 from urlparse import urlsplit
 
+try:
+  import lzma
+except ImportError:
+  try:
+    from backports import lzma
+  except ImportError:
+    lzma = None  # xz files are read through the xz command instead
+
+COMPRESSION_SUFFIXES = ('.gz', '.bz2', '.xz')
+
 def read_har_file(filename):
   "Read filename and return the header dictionaries for it."
-  fhandle = open(filename)
+  request_headers = []
+  response_headers = []
+  for request, response in iter_har_file(filename):
+    request_headers.append(request)
+    response_headers.append(response)
+  return (request_headers, response_headers)
+
+
+def iter_har_file(filename):
+  """
+  Generate (request, response) header dictionaries from filename, reading
+  it one entry at a time. Other formats are read by iter_input_items().
+  """
+  return items2hdrs(filename, iter_input_items(filename))
+
+
+def iter_har_items(filename):
+  """
+  Like iter_har_file(), but generate the headers as entry2items() does.
+  Raises ValueError if the file can't be parsed.
+  """
+  for _, items in iter_timed_har_items(filename, timed=False):
+    yield items
+
+
+def iter_timed_har_items(filename, timed=True):
+  """
+  Like iter_har_items(), but generate (time, items), where time is the
+  entry's startedDateTime in seconds since the epoch (or None, if not
+  timed).
+  """
+  fhandle = open_har_file(filename)
   try:
-    har = json.loads(fhandle.read(), object_hook=encode_strings)
-    # and now lets convert all strings to utf8.
-  except Exception as oops:
-    sys.stderr.write("Unable to parse %s\n\n" % filename)
-    sys.stderr.write(oops)
-    sys.exit(1)
+    for entry in HarReader(fhandle).entries():
+      items = entry2items(entry)
+      if not items:
+        continue
+      time = None
+      if timed:
+        time = parse_time(entry.get("startedDateTime"))
+      yield time, items
   finally: 
     fhandle.close()
-  return har2hdrs(har)
+
+
+def iter_interleaved_items(filenames):
+  """
+  Generate the headers of the entries of HAR files like iter_har_items(),
+  but merged in order of their startedDateTime, as an intermediary that
+  all of their traffic went through would see them. Each file is read as
+  the merge goes, so they're all open at once; their entries are expected
+  to be in time order, as browsers write them. Exits if one can't be
+  parsed.
+  """
+  def timed_entries(number, filename):
+    "Generate (time, file number, entry number, items) for a file."
+    for entry_num, (time, items) in enumerate(
+        check_items(filename, iter_timed_har_items(filename))):
+      yield time, number, entry_num, items
+  streams = [timed_entries(number, filename)
+             for number, filename in enumerate(filenames)]
+  for _, _, _, items in heapq.merge(*streams):
+    yield items
+
+
+TIME_RE = re.compile(
+  r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d(?:\.\d+)?)")
+TIME_OFFSET_RE = re.compile(r"([+-])(\d\d):?(\d\d)$")
+
+def parse_time(text):
+  """
+  Return an ISO 8601 date and time, as in startedDateTime, in seconds
+  since the epoch. Raises ValueError if it isn't one.
+  """
+  match = TIME_RE.match(text or '')
+  if not match:
+    raise ValueError("bad startedDateTime: %r" % text)
+  seconds = calendar.timegm([int(part) for part in match.groups()[:5]] +
+                            [0, 0, 0, 0]) + float(match.group(6))
+  offset = TIME_OFFSET_RE.search(text)
+  if offset:
+    sign, hours, minutes = offset.groups()
+    seconds -= int(sign + '1') * (int(hours) * 3600 + int(minutes) * 60)
+  return seconds
+
+
+def iter_input_items(filename):
+  """
+  Like iter_har_items(), but read filename with the reader registered for
+  its suffix (ignoring any compression suffix) in INPUT_READERS, or as a
+  HAR file if there's none.
+  """
+  name = filename
+  for suffix in COMPRESSION_SUFFIXES:
+    if name.endswith(suffix):
+      name = name[:-len(suffix)]
+      break
+  for suffix, read_items in INPUT_READERS.items():
+    if name.endswith(suffix):
+      return read_items(filename)
+  return iter_har_items(filename)
+
+
+def input_suffixes():
+  "Return the file name suffixes of the input formats, compressed or not."
+  return tuple([suffix + compression for suffix in INPUT_READERS
+                for compression in ('',) + COMPRESSION_SUFFIXES])
+
+
+def iter_jsonl_items(filename):
+  """
+  Like iter_har_items(), but read a JSON lines file: each line an object
+  with the "request" and "response" headers of an exchange. Headers are
+  given as an object, a list of [name, value] or a list of HAR-style
+  {"name": name, "value": value}, with HTTP/2-style pseudo-headers:
+
+    {"request": [[":method", "GET"], [":path", "/"],
+                 [":authority", "example.com"], ["accept", "*/*"]],
+     "response": {":status": "200", "content-type": "text/html"}}
+
+  Requests need :method, :path and :authority (or :host, or host);
+  responses need :status. The other pseudo-headers that HAR files give are
+  filled in if they're missing.
+  """
+  fhandle = open_har_file(filename)
+  try:
+    for line_num, line in enumerate(fhandle, 1):
+      if not line.strip():
+        continue
+      try:
+        exchange = json.loads(line, object_pairs_hook=OrderedDict)
+        items = (jsonl_headers(exchange["request"], REQUEST_PSEUDO_HEADERS),
+                 jsonl_headers(exchange["response"], RESPONSE_PSEUDO_HEADERS))
+      except (ValueError, KeyError, TypeError, AttributeError) as oops:
+        raise ValueError("line %i: %s: %s" % (
+          line_num, oops.__class__.__name__, oops))
+      yield items
+  finally:
+    fhandle.close()
+
+
+REQUEST_PSEUDO_HEADERS = [  # (name, default or None if it's needed)
+  (':method', None), (':path', None), (':scheme', 'http'),
+  (':version', 'HTTP/1.1'), (':host', None)]
+RESPONSE_PSEUDO_HEADERS = [
+  (':status', None), (':status-text', ''), (':version', 'HTTP/1.1')]
+
+
+def jsonl_headers(headers, pseudo_headers):
+  """
+  Return the header items of a message in a JSON lines file, normalised
+  like those of HAR files, with the pseudo-headers that are missing added.
+  """
+  if isinstance(headers, dict):
+    headers = headers.items()
+  hdrdicts = []
+  for header in headers:
+    if isinstance(header, dict):
+      name, value = header["name"], header["value"]
+    else:
+      name, value = header
+    if name == ':authority':
+      name = ':host'
+    if isinstance(value, (int, long)):
+      value = str(value)
+    hdrdicts.append({"name": name.encode('latin-1'),
+                     "value": value.encode('latin-1')})
+  out = process_headers(hdrdicts)
+  for name, default in pseudo_headers:
+    if name in out:
+      continue
+    if default is None:
+      raise ValueError("no %s header" % name)
+    out[name] = default
+  if ':method' in out:
+    out[':method'] = out[':method'].lower()
+  else:
+    out[':status-text'] = out[':status-text'].strip() or \
+      STATUS_PHRASES.get(out[':status'], 'unknown')
+  return out.items()
+
+
+def iter_http1_items(filename):
+  """
+  Like iter_har_items(), but read raw HTTP/1 message heads, as
+  sample_exec_codec.py does: each the start line and header lines of a
+  message, then an empty line, with each request's head followed by its
+  response's.
+  """
+  fhandle = open_har_file(filename)
+  try:
+    heads = iter_http1_heads(fhandle)
+    for request in heads:
+      response = next(heads, None)
+      if response is None:
+        raise ValueError("no response to %s" % request[0])
+      yield http1_request_items(request), http1_response_items(response)
+  finally:
+    fhandle.close()
+
+
+def iter_http1_heads(lines):
+  "Generate (start line, [(name, value), ...]) for each head in lines."
+  start, headers = None, []
+  for line in lines:
+    line = line.rstrip('\r\n')
+    if start is None:
+      start = line or None  # skip empty lines between heads
+    elif not line:
+      yield start, headers
+      start, headers = None, []
+    elif line[0] in ' \t' and headers:  # continues the last header
+      headers[-1] = (headers[-1][0], "%s %s" % (headers[-1][1], line.strip()))
+    else:
+      name, colon, value = line.partition(':')
+      if not colon:
+        raise ValueError("bad header line: %r" % line)
+      headers.append((name.strip(), value.strip()))
+  if start is not None:
+    yield start, headers
+
+
+def http1_request_items(head):
+  "Return the header items of a request head, normalised like entry2items."
+  start, headers = head
+  try:
+    method, target, version = start.split(None, 2)
+  except ValueError:
+    raise ValueError("bad request line: %r" % start)
+  req_headers = process_headers([{"name": name, "value": value}
+                                 for name, value in headers])
+  url = urlsplit(target)
+  req_headers[":method"] = method.lower()
+  req_headers[":path"] = target
+  if url.netloc:  # absolute form
+    req_headers[":path"] = url.path or '/'
+    if url.query:
+      req_headers[":path"] += "?%s" % url.query
+  req_headers[":scheme"] = url.scheme.lower() or 'http'
+  req_headers[":version"] = version
+  if url.netloc:
+    req_headers[":host"] = url.netloc
+  elif ":host" not in req_headers:
+    raise ValueError("no host for %r" % start)
+  return req_headers.items()
+
+
+def http1_response_items(head):
+  "Return the header items of a response head, normalised like entry2items."
+  start, headers = head
+  parts = start.split(None, 2)
+  if len(parts) < 2:
+    raise ValueError("bad status line: %r" % start)
+  res_headers = process_headers([{"name": name, "value": value}
+                                 for name, value in headers])
+  res_headers[":status"] = parts[1]
+  res_headers[":status-text"] = parts[2:] and parts[2].strip() or \
+    STATUS_PHRASES.get(parts[1], 'unknown')
+  res_headers[":version"] = parts[0]
+  return res_headers.items()
+
+
+def open_har_file(filename):
+  """
+  Open a HAR (or other input) file for reading, decompressing it as it's
+  read if it's compressed with gzip, bzip2 or xz.
+  """
+  fhandle = open(filename, 'rb')
+  magic = fhandle.read(6)
+  fhandle.close()
+  if magic.startswith('\x1f\x8b'):
+    return gzip.open(filename, 'rb')
+  if magic.startswith('BZh'):
+    return bz2.BZ2File(filename, 'rb')
+  if magic == '\xfd7zXZ\x00':
+    if lzma:
+      return lzma.LZMAFile(filename, 'rb')
+    return XzPipe(filename)
+  return open(filename, 'rb')
+
+
+class XzPipe(object):
+  "Reads an xz-compressed file through the xz command."
+  def __init__(self, filename):
+    self.filename = filename
+    self.process = subprocess.Popen(['xz', '-dc', filename],
+                                    stdout=subprocess.PIPE)
+
+  def read(self, size=-1):
+    "Read up to size decompressed bytes."
+    return self.process.stdout.read(size)
+
+  def __iter__(self):
+    return iter(self.process.stdout)
+
+  def close(self):
+    "Close the pipe, and fail if xz did."
+    self.process.stdout.close()
+    if self.process.wait() not in (0, -13):  # -13: SIGPIPE, if closed early
+      raise IOError("xz failed on %s" % self.filename)
+
+
+def expand_paths(paths, suffixes=None):
+  """
+  Return the list of files that paths stand for: directories stand for the
+  files in them (and their subdirectories) whose names end with one of
+  suffixes (by default, input_suffixes()), and glob patterns for the files
+  (or directories) they match. Raises ValueError for a pattern that
+  matches nothing.
+  """
+  if suffixes is None:
+    suffixes = input_suffixes()
+  filenames = []
+  for path in paths:
+    if os.path.isdir(path):
+      for dirpath, dirnames, files in os.walk(path):
+        dirnames.sort()
+        filenames.extend([os.path.join(dirpath, name) for name in sorted(files)
+                          if name.endswith(suffixes)])
+    elif glob.has_magic(path) and not os.path.exists(path):
+      matches = sorted(glob.glob(path))
+      if not matches:
+        raise ValueError("nothing matches %s" % path)
+      filenames.extend(expand_paths(matches, suffixes))
+    else:
+      filenames.append(path)
+  return filenames
+
+
+def items2hdrs(filename, items):
+  """
+  Generate (request, response) header dictionaries from items, generated
+  for filename by iter_har_items() or the like. Exits if it can't be
+  parsed.
+  """
+  for req_items, res_items in check_items(filename, items):
+    yield dict(req_items), dict(res_items)
+
+
+def check_items(filename, items):
+  "Generate items, exiting if filename turns out not to be parseable."
+  try:
+    for item in items:
+      yield item
+  except ValueError as oops:
+    parse_failed(filename, oops)
+
+
+def parse_failed(filename, oops):
+  "Report that filename couldn't be parsed, and exit."
+  sys.stderr.write("Unable to parse %s\n\n" % filename)
+  sys.stderr.write("%s\n" % oops)
+  sys.exit(1)
+
+
+def iter_har_files(filenames, jobs=1, read_items=iter_input_items,
+                   as_items=False):
+  """
+  Generate (filename, headers) for each of filenames, in order, where
+  headers is an iterable of (request, response) header dictionaries, or
+  of entry2items() lists with as_items. read_items is iter_input_items(),
+  or a function like it.
+
+  With more than one job (or None, for one per CPU), files are read ahead
+  by a pool of processes, which send back each file's headers as one
+  marshalled string of entry2items() lists rather than pickled dictionaries.
+  """
+  if jobs == 1:
+    for filename in filenames:
+      if as_items:
+        yield filename, check_items(filename, read_items(filename))
+      else:
+        yield filename, items2hdrs(filename, read_items(filename))
+    return
+  pool = multiprocessing.Pool(jobs)
+  try:
+    window = 2 * (jobs or multiprocessing.cpu_count())
+    filenames = iter(filenames)
+    pending = deque()
+    while True:
+      while len(pending) < window:
+        filename = next(filenames, None)
+        if filename is None:
+          break
+        pending.append((filename, pool.apply_async(
+          read_marshalled_items, [(filename, read_items)])))
+      if not pending:
+        break
+      filename, result = pending.popleft()
+      data, error = result.get()
+      if error is not None:
+        parse_failed(filename, error)
+      if as_items:
+        yield filename, marshal.loads(data)
+      else:
+        yield filename, [(dict(req_items), dict(res_items))
+                         for req_items, res_items in marshal.loads(data)]
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def read_marshalled_items(args):
+  """
+  Worker for iter_har_files(); args is (filename, read_items). Returns
+  (marshalled list of items, None), or (None, error) if the file can't be
+  parsed.
+  """
+  filename, read_items = args
+  try:
+    return marshal.dumps(list(read_items(filename))), None
+  except ValueError as oops:
+    return None, str(oops)
+
+
+PARSE_CACHE_MAGIC = 'ct-hdrs-1'
+PARSE_CACHE_BATCH = 256  # (request, response) pairs per marshalled record
+
+
+def iter_cached_har_items(filename, cache_dir=None):
+  """
+  Generate the headers of filename like iter_input_items(), but keep them in
+  a parse cache file: filename.hdrs, or a file in cache_dir named after
+  the path of filename.
+
+  The cache is used while filename's size and modification time are those
+  it was made from, or its content still has the same SHA-1 digest (when
+  the cache takes the new modification time); otherwise it's made again. Headers are kept in the order they were added
+  (see entry2items()), so the dictionaries made from them are just like
+  those parsed.
+  """
+  if cache_dir is None:
+    cache_path = filename + '.hdrs'
+  else:
+    cache_path = os.path.join(cache_dir, hashlib.sha1(
+      os.path.abspath(filename)).hexdigest() + '.hdrs')
+  stat = os.stat(filename)
+  try:
+    cfh = open(cache_path, 'rb')
+  except IOError:
+    cfh = None
+  if cfh is not None:
+    try:
+      try:
+        magic, size, mtime, digest = marshal.load(cfh)
+      except (EOFError, ValueError, TypeError):
+        magic = None
+      if magic == PARSE_CACHE_MAGIC and size == stat.st_size and (
+          mtime == stat.st_mtime or digest == file_digest(filename)):
+        if mtime != stat.st_mtime:
+          touch_parse_cache(cache_path, cfh.tell(),
+                            (magic, size, stat.st_mtime, digest))
+        while True:
+          try:
+            batch = marshal.load(cfh)
+          except EOFError:
+            return
+          for items in batch:
+            yield items
+    finally:
+      cfh.close()
+
+  if cache_dir is not None and not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
+  tmp_path = "%s.%i.tmp" % (cache_path, os.getpid())
+  cfh = open(tmp_path, 'wb')
+  try:
+    marshal.dump((PARSE_CACHE_MAGIC, stat.st_size, stat.st_mtime,
+                  file_digest(filename)), cfh)
+    batch = []
+    for items in iter_input_items(filename):
+      batch.append(items)
+      if len(batch) == PARSE_CACHE_BATCH:
+        marshal.dump(batch, cfh)
+        batch = []
+      yield items
+    if batch:
+      marshal.dump(batch, cfh)
+    cfh.close()
+    os.rename(tmp_path, cache_path)
+  finally:
+    if not cfh.closed:
+      cfh.close()
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+
+
+def touch_parse_cache(cache_path, header_size, header):
+  """
+  Write header over the one (of header_size bytes) at the start of a parse
+  cache, so that the file it was made from isn't hashed again just because
+  its modification time changed. Does nothing if the sizes differ, or the
+  cache can't be written.
+  """
+  data = marshal.dumps(header)
+  if len(data) != header_size:
+    return
+  try:
+    cfh = open(cache_path, 'r+b')
+  except IOError:
+    return
+  try:
+    cfh.write(data)
+  finally:
+    cfh.close()
+
+
+class HarReader(object):
+  """
+  Reads the entries of a HAR file one at a time, without reading the whole
+  file into memory, or keeping the parts of entries that aren't needed.
+
+  The values of the keys in skip (anywhere in an entry) are scanned past
+  without being kept, and read as null; by default, these are the bodies
+  of requests and responses.
+  """
+  WHITESPACE = re.compile(r'[ \t\n\r]*')
+  STRUCTURE = re.compile(r'["{}\[\]]')
+  SCALAR_END = re.compile(r'[,}\] \t\n\r]')
+  STRING_CHARS = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+
+  def __init__(self, fhandle, skip=('content', 'postData'),
+               chunk_size=1 << 16):
+    self.fhandle = fhandle
+    self.skip = set(['"%s"' % key for key in skip])
+    self.chunk_size = chunk_size
+    self.buf = ''
+    self.pos = 0
+    self.offset = 0  # how much of the file is before buf
+    self.mark = None  # start of the text being kept in buf, if any
+    self.kept = []  # text kept before mark
+
+  def entries(self):
+    "Generate the entries of the HAR file, as dictionaries."
+    if not self.find_key('log') or not self.find_key('entries'):
+      raise ValueError("no log.entries")
+    self.expect('[')
+    if self.peek() == ']':
+      return
+    while True:
+      self.peek()
+      self.mark = self.pos
+      self.scan_value(self.skip)
+      self.kept.append(self.buf[self.mark:self.pos])
+      self.mark = None
+      text = ''.join(self.kept)
+      self.kept = []
+      yield json.loads(text, object_hook=encode_strings)
+      if self.expect(',]') == ']':
+        return
+
+  def fill(self):
+    """
+    Read more of the file into buf, dropping the text before pos (or mark).
+    Returns False at the end of the file.
+    """
+    data = self.fhandle.read(self.chunk_size)
+    if not data:
+      return False
+    drop = self.pos if self.mark is None else self.mark
+    self.buf = self.buf[drop:] + data
+    self.offset += drop
+    self.pos -= drop
+    if self.mark is not None:
+      self.mark -= drop
+    return True
+
+  def peek(self):
+    "Skip whitespace, and return the next character ('' at the end)."
+    while True:
+      self.pos = self.WHITESPACE.match(self.buf, self.pos).end()
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if not self.fill():
+        return ''
+
+  def expect(self, chars):
+    "Read one of chars (after any whitespace), and return it."
+    char = self.peek()
+    if not char or char not in chars:
+      raise ValueError("expected %s at offset %i" % (
+        ' or '.join(chars), self.offset + self.pos))
+    self.pos += 1
+    return char
+
+  def find_key(self, key):
+    """
+    Read the object starting here up to the value of key. Returns False if
+    it isn't there.
+    """
+    self.expect('{')
+    if self.peek() == '}':
+      self.pos += 1
+      return False
+    while True:
+      if self.peek() != '"':
+        self.expect('"')
+      start = self.offset + self.pos
+      self.mark = self.pos
+      self.scan_string()
+      name = json.loads(self.buf[start - self.offset:self.pos])
+      self.mark = None
+      self.expect(':')
+      if name == key:
+        return True
+      self.scan_value()
+      if self.expect(',}') == '}':
+        return False
+
+  def scan_string(self):
+    "Move past the string starting here."
+    self.pos += 1
+    while True:
+      self.pos = self.STRING_CHARS.match(self.buf, self.pos).end()
+      if self.pos < len(self.buf) and self.buf[self.pos] == '"':
+        self.pos += 1
+        return
+      if not self.fill():  # and so, a backslash at the end is kept
+        raise ValueError("unterminated string")
+
+  def scan_value(self, skip=None):
+    """
+    Move past the value starting here. If text is being kept, the values
+    of keys in skip are replaced by null.
+    """
+    char = self.peek()
+    if char == '"':
+      self.scan_string()
+      return
+    if char not in '{[':
+      while True:
+        match = self.SCALAR_END.search(self.buf, self.pos)
+        if match:
+          self.pos = match.start()
+          return
+        self.pos = len(self.buf)
+        if not self.fill():
+          return
+    depth = 0
+    while True:
+      match = self.STRUCTURE.search(self.buf, self.pos)
+      if not match:
+        self.pos = len(self.buf)
+        if not self.fill():
+          raise ValueError("unexpected end of file")
+        continue
+      self.pos = match.start()
+      char = match.group()
+      if char == '"':
+        start = self.offset + self.pos
+        self.scan_string()
+        if skip and self.buf[start - self.offset:self.pos] in skip and \
+           self.peek() == ':':
+          self.pos += 1
+          self.kept.append(self.buf[self.mark:self.pos] + 'null')
+          self.mark = None
+          self.scan_value()
+          self.mark = self.pos
+        continue
+      self.pos += 1
+      depth += char in '{[' and 1 or -1
+      if depth == 0:
+        return
+
+
+def file_digest(filename, blocksize=1 << 20):
+  "Return the SHA-1 hex digest of a file's content."
+  digest = hashlib.sha1()
+  fhandle = open(filename, 'rb')
+  try:
+    block = fhandle.read(blocksize)
+    while block:
+      digest.update(block)
+      block = fhandle.read(blocksize)
+  finally:
+    fhandle.close()
+  return digest.hexdigest()
 
 
 def har2hdrs(har):
@@ -40,35 +728,57 @@ def har2hdrs(har):
   request_headers = []
   response_headers = []
   for entry in har["log"]["entries"]:
-    request = entry["request"]
-    url = urlsplit(request["url"])
-    if not url.scheme.lower() in ["http", "https"]:
-      continue
-    headers = process_headers(request["headers"])
-    headers[":method"] = request["method"].lower()
-    headers[":path"] = url.path
-    if url.query:
-      headers[":path"] += "?%s" % url.query
-    headers[":scheme"] = url.scheme.lower()
-    headers[":version"] = request["httpVersion"]
-    if not ":host" in request_headers:
-      headers[":host"] = re.sub("^[^:]*://([^/]*)/.*$", "\\1", request["url"])
-    request_headers.append(headers)
-
-    response = entry["response"]
-    headers = process_headers(response["headers"])
-    headers[":status"] = re.sub("^([0-9]*).*", "\\1", str(response["status"]))
-    headers[":status-text"] = response["statusText"].strip() or \
-      STATUS_PHRASES.get(headers[':status'], 'unknown')
-    headers[":version"] = response["httpVersion"]
-    response_headers.append(headers)
-
+    headers = entry2hdrs(entry)
+    if headers:
+      request_headers.append(headers[0])
+      response_headers.append(headers[1])
   return (request_headers, response_headers)
 
 
+def entry2hdrs(entry):
+  """
+  Convert a har entry dictionary to (request, response) header
+  dictionaries, or None if it isn't for HTTP.
+  """
+  items = entry2items(entry)
+  return items and (dict(items[0]), dict(items[1]))
+
+
+def entry2items(entry):
+  """
+  Like entry2hdrs(), but return the headers as lists of (name, value) in
+  the order they were added. The order of dictionaries made from them is
+  then the same each time (and so, that of the codecs' output).
+  """
+  request = entry["request"]
+  url = urlsplit(request["url"])
+  if not url.scheme.lower() in ["http", "https"]:
+    return None
+  req_headers = process_headers(request["headers"])
+  req_headers[":method"] = request["method"].lower()
+  req_headers[":path"] = url.path
+  if url.query:
+    req_headers[":path"] += "?%s" % url.query
+  req_headers[":scheme"] = url.scheme.lower()
+  req_headers[":version"] = request["httpVersion"]
+  req_headers[":host"] = re.sub("^[^:]*://([^/]*)/.*$", "\\1", request["url"])
+
+  response = entry["response"]
+  res_headers = process_headers(response["headers"])
+  res_headers[":status"] = re.sub("^([0-9]*).*", "\\1",
+                                  str(response["status"]))
+  res_headers[":status-text"] = response["statusText"].strip() or \
+    STATUS_PHRASES.get(res_headers[':status'], 'unknown')
+  res_headers[":version"] = response["httpVersion"]
+  return (req_headers.items(), res_headers.items())
+
+
 def process_headers(hdrdicts):
-  "Take a har header datastructure and return a normalised dictionary."
-  out = {}
+  """
+  Take a har header datastructure and return a normalised dictionary,
+  which keeps the order headers were added in.
+  """
+  out = OrderedDict()
   for hdrdict in hdrdicts:
     name = hdrdict["name"].lower()
     val = hdrdict["value"]
@@ -122,3 +832,11 @@ STATUS_PHRASES = {
   '500': 'Internal Server Error',
 }
 
+
+# Readers of input formats other than HAR, by file name suffix; see
+# iter_input_items().
+INPUT_READERS = OrderedDict([
+  ('.har', iter_har_items),
+  ('.jsonl', iter_jsonl_items),
+  ('.http', iter_http1_items),
+])
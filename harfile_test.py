@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# pylint: disable=W0311
+
+import json
+import marshal
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+
+import harfile
+
+
+def Check(what, value, expected):
+  if value != expected:
+    print "Failure!: %s is %r; expected %r" % (what, value, expected)
+    raise StandardError()
+
+
+def CheckRaises(what, func, *args):
+  try:
+    func(*args)
+  except ValueError:
+    return
+  print "Failure!: %s didn't raise ValueError" % what
+  raise StandardError()
+
+
+def make_entry(number):
+  "Return a HAR entry with awkward strings, bodies and scalars."
+  return {
+    "startedDateTime": "2012-10-01T12:00:%02i.5+00:00" % number,
+    "time": -12.5e-1,
+    "cached": number % 2 == 0,
+    "nothing": None,
+    "request": {
+      "method": "GET",
+      "url": "http://example.com/%i?q=\"{[}]\"" % number,
+      "httpVersion": "HTTP/1.1",
+      "headers": [
+        {"name": "Host", "value": "example.com"},
+        {"name": "content", "value": "content"},
+        {"name": "X-Quote", "value": 'a \\" b \\\\" c \\'},
+        {"name": "X-Latin", "value": u"caf\xe9 \t\n"},
+        {"name": "Cookie", "value": "a=1"},
+        {"name": "Cookie", "value": "b=2"},
+      ],
+      "postData": {"mimeType": "text/plain",
+                   "text": "]}\\\"{[ \"content\": {",
+                   "params": [{"name": "x", "value": [1, {"y": "}"}]}]},
+    },
+    "response": {
+      "status": 200,
+      "statusText": "",
+      "httpVersion": "HTTP/1.1",
+      "headers": [{"name": "Content-Type", "value": "text/html"}],
+      "content": {"size": 3, "text": "{\"content\": [\"]\"]}",
+                  "nested": {"content": "\\\\"}},
+    },
+  }
+
+
+def without_skipped(value, skip=('content', 'postData')):
+  "Return value with the values of keys in skip, anywhere, made None."
+  if isinstance(value, dict):
+    return dict([(key, None if key in skip else without_skipped(val))
+                 for key, val in value.items()])
+  if isinstance(value, list):
+    return [without_skipped(item) for item in value]
+  return value
+
+
+def check_reader():
+  "HarReader must read what json does, whatever the chunk size."
+  har = {"x": {"entries": "{["}, "log": {
+    "pages": [{"id": "}]"}], "entries": [make_entry(n) for n in range(5)],
+    "version": "1.2"}}
+  expected = without_skipped(json.loads(
+    json.dumps(har), object_hook=harfile.encode_strings)['log']['entries'])
+  for text in [json.dumps(har), json.dumps(har, indent=1),
+               json.dumps(har, separators=(',', ':'))]:
+    for chunk_size in [1, 2, 3, 7, 1 << 16]:
+      reader = harfile.HarReader(StringIO(text), chunk_size=chunk_size)
+      Check("entries read %i at a time" % chunk_size,
+            list(reader.entries()), expected)
+
+  empty = '{"log": {"entries": [ ]}}'
+  Check("no entries", list(harfile.HarReader(StringIO(empty)).entries()), [])
+  for bad in ['{"log": {"pages": []}}', '{"log": {"entries": [{"a": "b',
+              '{"log": {"entries": [{"a": 1}}']:
+    for chunk_size in [1, 1 << 16]:
+      reader = harfile.HarReader(StringIO(bad), chunk_size=chunk_size)
+      CheckRaises(bad, list, reader.entries())
+
+
+def check_cache(directory):
+  "The parse cache must give what parsing does, and notice changes."
+  path = os.path.join(directory, 'a.har')
+  def write(entries):
+    hfh = open(path, 'w')
+    json.dump({"log": {"entries": entries}}, hfh)
+    hfh.close()
+  write([make_entry(n) for n in range(300)])  # more than a batch
+  parsed = list(harfile.iter_input_items(path))
+  Check("first read", list(harfile.iter_cached_har_items(path)), parsed)
+  Check("cache made", os.path.exists(path + '.hdrs'), True)
+  Check("cached read", list(harfile.iter_cached_har_items(path)), parsed)
+
+  stat = os.stat(path)
+  os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+  Check("read after a touch", list(harfile.iter_cached_har_items(path)),
+        parsed)
+  cfh = open(path + '.hdrs', 'rb')
+  Check("time kept", marshal.load(cfh)[2], os.stat(path).st_mtime)
+  cfh.close()
+  def no_digest(filename):
+    raise StandardError("%s hashed again" % filename)
+  file_digest, harfile.file_digest = harfile.file_digest, no_digest
+  try:
+    Check("read after the time's kept",
+          list(harfile.iter_cached_har_items(path)), parsed)
+  finally:
+    harfile.file_digest = file_digest
+
+  cache_dir = os.path.join(directory, 'cache')
+  Check("read to a cache dir",
+        list(harfile.iter_cached_har_items(path, cache_dir)), parsed)
+  Check("cache dir used", len(os.listdir(cache_dir)), 1)
+
+  write([make_entry(n) for n in range(301)])
+  Check("read after a change", list(harfile.iter_cached_har_items(path)),
+        list(harfile.iter_input_items(path)))
+
+  data, error = harfile.read_marshalled_items((path, harfile.iter_har_items))
+  Check("marshalled items", (marshal.loads(data), error),
+        (list(harfile.iter_har_items(path)), None))
+  hfh = open(path, 'w')
+  hfh.write('{"log": {}}')
+  hfh.close()
+  data, error = harfile.read_marshalled_items((path, harfile.iter_har_items))
+  Check("unparsable file", (data, error), (None, "no log.entries"))
+
+
+def main():
+  check_reader()
+  directory = tempfile.mkdtemp()
+  try:
+    check_cache(directory)
+  finally:
+    shutil.rmtree(directory)
+  print "Success!"
+
+
+main()
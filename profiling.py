@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+Per-codec profiling for compare_compressors.py.
+"""
+
+# pylint: disable=W0311
+
+from collections import defaultdict
+import cProfile
+import os.path
+import pstats
+import signal
+
+
+class CodecProfiler(object):
+  """
+  Profiles the codec calls made through call(), keeping cProfile statistics
+  for each codec and direction ('compress' or 'decompress').
+
+  With a sample_interval (in seconds of CPU time), the call stack inside
+  the codec is also sampled, to make collapsed-stack files for flame graph
+  tools (e.g., flamegraph.pl). The sampler runs inside the profiled call,
+  so it calls nothing that cProfile would see, and its own entry is left
+  out of the statistics.
+  """
+  def __init__(self, sample_interval=None):
+    self.profiles = {}  # (name, direction) -> cProfile.Profile
+    self.stacks = {}  # (name, direction) -> (code, ...) -> number of samples
+    self.others = []  # snapshots merged from other processes
+    self.sample_interval = sample_interval
+    self.current = None  # (name, direction) of the call being profiled
+    if sample_interval:
+      # The timer runs throughout, so that short calls are sampled too, but
+      # only samples taken inside a codec call are counted.
+      signal.signal(signal.SIGPROF, self.sample)
+      signal.siginterrupt(signal.SIGPROF, False)  # e.g., fork's pipe reads
+      signal.setitimer(signal.ITIMER_PROF, sample_interval, sample_interval)
+
+  def call(self, name, direction, func, *args):
+    "Call func(*args) as the codec name's direction, and profile it."
+    key = (name, direction)
+    if key not in self.profiles:
+      self.profiles[key] = cProfile.Profile()
+      self.stacks[key] = {}
+    profile = self.profiles[key]
+    self.current = key
+    profile.enable()
+    try:
+      return func(*args)
+    finally:
+      profile.disable()
+      self.current = None
+
+  def sample(self, signum, frame):
+    """
+    SIGPROF handler; counts the codec's current call stack, innermost code
+    first. Only operators and calls of types, which cProfile doesn't trace,
+    are used.
+    """
+    if self.current is None:
+      return
+    codes = []
+    while frame is not None and frame.f_code is not CALL_CODE:
+      codes += (frame.f_code,)
+      frame = frame.f_back
+    if frame is not None and codes:
+      stacks = self.stacks[self.current]
+      codes = tuple(codes)
+      try:
+        stacks[codes] += 1
+      except KeyError:
+        stacks[codes] = 1
+
+  def stop(self):
+    "Stop sampling; call this before the process exits."
+    if self.sample_interval:
+      signal.setitimer(signal.ITIMER_PROF, 0)
+      signal.signal(signal.SIGPROF, signal.SIG_IGN)
+
+  def snapshot(self):
+    """
+    Return the statistics gathered so far in a form that can be sent to
+    another process and merged there.
+    """
+    snapshot = {}
+    for key, profile in self.profiles.items():
+      profile.create_stats()
+      profile_stats = dict(profile.stats)
+      profile_stats.pop(SAMPLE_LABEL, None)
+      stacks = defaultdict(int)
+      for codes, count in self.stacks[key].items():
+        stacks[';'.join(["%s (%s:%i)" % (
+          code.co_name, os.path.basename(code.co_filename),
+          code.co_firstlineno) for code in reversed(codes)])] += count
+      snapshot[key] = (profile_stats, dict(stacks))
+    return snapshot
+
+  def merge(self, snapshot):
+    "Add a snapshot() from another process to these statistics."
+    self.others.append(snapshot)
+
+  def write(self, directory):
+    """
+    Write 'name.direction.pstats' for each codec and direction to
+    directory, along with 'name.direction.folded' collapsed stacks if any
+    were sampled. Returns the paths written.
+    """
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    stats = {}
+    stacks = defaultdict(lambda: defaultdict(int))
+    for snapshot in [self.snapshot()] + self.others:
+      for key, (profile_stats, key_stacks) in snapshot.items():
+        if key in stats:
+          stats[key].add(StatsHolder(profile_stats))
+        else:
+          stats[key] = pstats.Stats(StatsHolder(profile_stats))
+        for stack, count in key_stacks.items():
+          stacks[key][stack] += count
+
+    paths = []
+    for (name, direction), key_stats in sorted(stats.items()):
+      path = os.path.join(directory, "%s.%s.pstats" % (name, direction))
+      key_stats.dump_stats(path)
+      paths.append(path)
+      if stacks.get((name, direction)):
+        path = os.path.join(directory, "%s.%s.folded" % (name, direction))
+        sfh = open(path, 'w')
+        for stack, count in sorted(stacks[(name, direction)].items()):
+          sfh.write("%s %i\n" % (stack, count))
+        sfh.close()
+        paths.append(path)
+    return paths
+
+CALL_CODE = CodecProfiler.call.__code__
+SAMPLE_LABEL = cProfile.label(CodecProfiler.sample.__code__)
+
+
+class StatsHolder(object):
+  "Profile statistics from a snapshot, in the form pstats.Stats loads."
+  def __init__(self, stats):
+    self.stats = dict(stats)
+
+  def create_stats(self):
+    "pstats calls this before taking self.stats."
+    pass
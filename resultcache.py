@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+An on-disk cache of the per-message results of running a codec over a HAR
+file, so that re-running a comparison only has to compute what's new.
+"""
+
+# pylint: disable=W0311
+
+import hashlib
+import os
+import struct
+import tempfile
+import time
+
+
+class ResultCache(object):
+  """
+  Results are kept in one file per HAR file content digest, codec module
+  name, codec parameters and codec version (e.g., a digest of its source),
+  holding flags and then a fixed-size record for each message:
+
+    (message type index, compressed size, input size,
+     compress wall time, compress CPU time,
+     decompress wall time, decompress CPU time)
+
+  Times are in seconds; decompression times are negative if it wasn't
+  timed. The UNCHECKED flag says that the codec's decompression wasn't
+  checked. Entries are written to a temporary file and renamed into place, so
+  readers never see partial ones. Reading an entry refreshes its mtime, which
+  is what eviction goes by.
+  """
+  magic = "ctcache2"
+  header = struct.Struct("<8sII")  # magic, number of records, flags
+  record = struct.Struct("<BIIdddd")
+
+  UNCHECKED = 1
+
+  def __init__(self, directory, max_age=None, max_size=None):
+    self.directory = directory
+    self.max_age = max_age  # seconds
+    self.max_size = max_size  # bytes
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def path(self, digest, module_name, params, version):
+    "Return the path of the entry for a file digest and codec."
+    key = hashlib.sha1("\0".join([digest, module_name, ",".join(params),
+                                  version])).hexdigest()
+    return os.path.join(self.directory, key[:2], key[2:])
+
+  def load(self, digest, module_name, params, version):
+    """
+    Return the list of records and the flags for a file digest and codec,
+    or None if there isn't a (complete) entry for them.
+    """
+    path = self.path(digest, module_name, params, version)
+    try:
+      fhandle = open(path, 'rb')
+    except IOError:
+      return None
+    try:
+      data = fhandle.read()
+    finally:
+      fhandle.close()
+    if len(data) < self.header.size:
+      return None
+    magic, count, flags = self.header.unpack_from(data)
+    if magic != self.magic or \
+       len(data) != self.header.size + count * self.record.size:
+      return None
+    try:
+      os.utime(path, None)
+    except OSError:
+      pass
+    offset, size = self.header.size, self.record.size
+    return [self.record.unpack_from(data, offset + i * size)
+            for i in xrange(count)], flags
+
+  def store(self, digest, module_name, params, version, records, flags=0):
+    "Store the list of records, and flags, for a file digest and codec."
+    path = self.path(digest, module_name, params, version)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+      try:
+        os.makedirs(directory)
+      except OSError:  # another process made it
+        pass
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp")
+    fhandle = os.fdopen(fd, 'wb')
+    try:
+      fhandle.write(self.header.pack(self.magic, len(records), flags))
+      for record in records:
+        fhandle.write(self.record.pack(*record))
+    finally:
+      fhandle.close()
+    os.rename(tmp_path, path)
+    return path
+
+  def evict(self):
+    """
+    Remove entries that haven't been used for max_age, and then the least
+    recently used ones until the cache is no bigger than max_size.
+    """
+    entries = []
+    for dirpath, _, filenames in os.walk(self.directory):
+      for filename in filenames:
+        path = os.path.join(dirpath, filename)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total = sum([size for _, size, _ in entries])
+    oldest = None
+    if self.max_age is not None:
+      oldest = time.time() - self.max_age
+    for mtime, size, path in entries:
+      if (oldest is None or mtime >= oldest) and \
+         (self.max_size is None or total <= self.max_size):
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      total -= size
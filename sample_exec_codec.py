@@ -1,13 +1,108 @@
 #!/usr/bin/env python
 
+# An example of an external codec for the fork codec, e.g.
+#   ./compare_compressors.py -c fork=sample_exec_codec.py,protocol:2
+# It "compresses" each message by echoing it back, and decompresses by
+# doing the same. It speaks protocol 2 (batches, through pipes or shared
+# memory, header lists and decoding) when the driver asks for it, and
+# protocol 1 otherwise; see compressor/fork/__init__.py.
+
+import mmap
 import sys
 import struct
 import os
 
+PROTOCOL_2_HELLO = 'fork-codec protocol:2 shm binary'
+
+def compress(data):
+  return data
+
+def decompress(data):
+  return data
+
+def write_result(out, data):
+  out.append(struct.pack("q", len(data)))
+  out.append(data)
+
+def read_exactly(size):
+  data = sys.stdin.read(size)
+  if len(data) != size:
+    sys.exit(0)
+  return data
+
+def attach(path):
+  # map the driver's shared memory file; the first half is its ring, the
+  # second ours
+  try:
+    fhandle = open(path, 'r+b')
+    mapping = mmap.mmap(fhandle.fileno(), 0)
+    fhandle.close()
+  except (IOError, OSError, mmap.error):
+    return None
+  return mapping, len(mapping) // 2, 0  # map, ring size, our ring's head
+
+def read_batch(data, pos):
+  count = struct.unpack_from("q", data, pos)[0]
+  pos += 8
+  messages = []
+  for _ in range(count):
+    size = struct.unpack_from("q", data, pos)[0]
+    messages.append(data[pos + 8:pos + 8 + size])
+    pos += 8 + size
+  return messages
+
+def protocol_2():
+  shm = None
+  codec = compress
+  while True:
+    count = struct.unpack("q", read_exactly(8))[0]
+    if count == -3:
+      codec = decompress
+      sys.stdout.write(struct.pack("q", 0))
+      sys.stdout.flush()
+      continue
+    if count == -4:
+      # messages are header lists from now on; echoing doesn't mind
+      sys.stdout.write(struct.pack("q", 0))
+      sys.stdout.flush()
+      continue
+    if count == -1:
+      size = struct.unpack("q", read_exactly(8))[0]
+      shm = attach(read_exactly(size))
+      sys.stdout.write(struct.pack("q", shm is None and 1 or 0))
+      sys.stdout.flush()
+      continue
+    if count == -2:
+      offset, size = struct.unpack("qq", read_exactly(16))
+      messages = read_batch(shm[0], offset)
+    else:
+      # read the whole batch before answering, so that neither side blocks
+      # writing to a full pipe
+      messages = []
+      for _ in range(count):
+        size = struct.unpack("q", read_exactly(8))[0]
+        messages.append(read_exactly(size))
+    out = []
+    for data in messages:
+      write_result(out, codec(data))
+    out = ''.join(out)
+    if count != -2:
+      sys.stdout.write(out)
+    elif len(out) > shm[1]:
+      sys.stdout.write(struct.pack("qq", -1, len(out)) + out)
+    else:
+      mapping, ring_size, head = shm
+      if head + len(out) > ring_size:
+        head = 0
+      mapping[ring_size + head:ring_size + head + len(out)] = out
+      sys.stdout.write(struct.pack("qq", head, len(out)))
+      shm = (mapping, ring_size, head + len(out))
+    sys.stdout.flush()
+
 def main():
+  first = True
   while True:
     headers = []
-    headers_len = 0
     name = ""
     if len(sys.argv) >= 2:
       name = sys.argv[1]
@@ -18,15 +113,21 @@ def main():
       if line == "":
         return
       headers.append(line)
-      headers_len += len(line)
       if line == "\r\n" or line == "\n":
         break
 
-
-    wire_len = struct.pack("q", headers_len)
-    sys.stdout.write(wire_len)
     data = ''.join(headers)
-    sys.stdout.write(data)
+    if first and data == "\r\n":
+      out = []
+      write_result(out, PROTOCOL_2_HELLO)
+      sys.stdout.write(''.join(out))
+      sys.stdout.flush()
+      return protocol_2()
+    first = False
+
+    out = []
+    write_result(out, compress(data))
+    sys.stdout.write(''.join(out))
     sys.stdout.flush()
 
 main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+Deduplication and stratified sampling of header messages, for quick runs
+on part of a corpus that still say how far they can be trusted.
+"""
+
+# pylint: disable=W0311
+
+from array import array
+from collections import defaultdict
+import hashlib
+import marshal
+import math
+import random
+
+
+class Deduplicator(object):
+  "Drops messages that are exact duplicates of ones seen before."
+  def __init__(self):
+    self.seen = set()  # digests of the messages seen
+    self.duplicates = 0
+
+  def unique(self, messages):
+    """
+    Generate the (message_type, header items, host) tuples in messages
+    that haven't been seen before.
+    """
+    seen = self.seen
+    for message_type, items, host in messages:
+      digest = hashlib.sha1(marshal.dumps(
+        (message_type, host, [tuple(item) for item in items]))).digest()
+      if digest in seen:
+        self.duplicates += 1
+        continue
+      seen.add(digest)
+      yield message_type, items, host
+
+
+class StratifiedSample(object):
+  """
+  A stratified sample of the messages in a corpus.Corpus, and the totals
+  needed to estimate each codec's overall ratio (to the baseline's size)
+  over the whole corpus from it, with a confidence interval.
+
+  Messages are stratified by type, host (the max_hosts busiest ones; the
+  rest share a stratum) and size (in powers of two), and fraction of
+  each stratum is sampled, but at least two messages where there are as
+  many. The ratio is estimated with the combined ratio estimator.
+  """
+  def __init__(self, fraction, seed=0, max_hosts=20):
+    self.fraction = fraction
+    self.seed = seed
+    self.max_hosts = max_hosts
+    self.population = []  # stratum -> number of messages
+    self.sampled = []  # stratum -> number of messages sampled
+    self.types = []  # stratum -> message type
+    self.strata = array('I')  # the stratum of each sampled message, in order
+    self.position = 0  # of the next message's results in strata
+    self.totals = defaultdict(lambda: defaultdict(lambda: [0] * 5))
+
+  def select(self, messages):
+    """
+    Generate the sampled (message_type, header items, host) tuples of a
+    corpus.Corpus, in its order.
+    """
+    host_counts = defaultdict(int)
+    for index in xrange(len(messages)):
+      host_counts[messages.message(index)[2]] += 1
+    busiest = set(sorted(host_counts, key=lambda host: -host_counts[host])[
+      :self.max_hosts])
+    stratum_ids = {}
+    members = []  # stratum -> [message index, ...]
+    for index in xrange(len(messages)):
+      message_type, _, host = messages.message(index)
+      size = 0
+      for name, value in messages.iteritems(index):
+        size += len(name) + len(value) + 4
+      key = (message_type, host in busiest and host or None,
+             size.bit_length())
+      if key not in stratum_ids:
+        stratum_ids[key] = len(members)
+        members.append([])
+        self.types.append(message_type)
+      members[stratum_ids[key]].append(index)
+
+    rng = random.Random(self.seed)
+    chosen = []  # (message index, stratum)
+    for stratum, indices in enumerate(members):
+      size = max(min(len(indices), 2),
+                 int(round(self.fraction * len(indices))))
+      self.population.append(len(indices))
+      self.sampled.append(size)
+      chosen.extend([(index, stratum)
+                     for index in rng.sample(indices, size)])
+    chosen.sort()
+    for index, stratum in chosen:
+      self.strata.append(stratum)
+    for index, _ in chosen:
+      message_type, message, host = messages.message(index)
+      yield message_type, message.items(), host
+
+  def add(self, results, baseline):
+    """
+    Add the results of processing the next sampled message (from
+    process_message()) to the totals, with sizes relative to baseline's.
+    """
+    stratum = self.strata[self.position]
+    self.position += 1
+    if baseline not in results:
+      return
+    base = results[baseline]['size']
+    for name, result in results.items():
+      if name[0] == "_":
+        continue
+      size = result['size']
+      totals = self.totals[results["_message_type"]][(name, stratum)]
+      totals[0] += base
+      totals[1] += size
+      totals[2] += base * base
+      totals[3] += size * size
+      totals[4] += base * size
+
+  def summary(self, message_type):
+    """
+    Return the number of messages of message_type, how many of them were
+    sampled, and from how many strata.
+    """
+    strata = [stratum for stratum, stratum_type in enumerate(self.types)
+              if stratum_type == message_type]
+    return (sum([self.population[stratum] for stratum in strata]),
+            sum([self.sampled[stratum] for stratum in strata]), len(strata))
+
+  def codecs(self, message_type):
+    "Return the names of the codecs with totals for message_type."
+    return sorted(set([name for name, _ in self.totals[message_type]]))
+
+  def interval(self, message_type, name, z=1.96):
+    """
+    Return the estimated ratio of codec name over all of the corpus's
+    messages of message_type, and the half-width of its confidence
+    interval (95% for the default z).
+    """
+    strata = [(stratum, totals) for (codec, stratum), totals
+              in self.totals[message_type].items() if codec == name]
+    base_total = size_total = 0.0
+    for stratum, (base, size, _, _, _) in strata:
+      weight = float(self.population[stratum]) / self.sampled[stratum]
+      base_total += weight * base
+      size_total += weight * size
+    if not base_total:
+      return 0.0, 0.0
+    ratio = size_total / base_total
+    variance = 0.0
+    for stratum, (base, size, base2, size2, cross) in strata:
+      population, sampled = self.population[stratum], self.sampled[stratum]
+      if sampled < 2:
+        continue
+      # sample variance of size - ratio * base in the stratum
+      residuals = size2 - 2 * ratio * cross + ratio * ratio * base2
+      mean = (size - ratio * base) / sampled
+      spread = (residuals - sampled * mean * mean) / (sampled - 1)
+      variance += population * population * \
+        (1 - float(sampled) / population) * max(spread, 0) / sampled
+    return ratio, z * math.sqrt(variance) / base_total
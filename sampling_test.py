@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# pylint: disable=W0311
+
+import random
+import zlib
+
+import corpus
+from sampling import Deduplicator, StratifiedSample
+
+
+def Check(what, value, expected, tolerance):
+  if abs(value - expected) > tolerance:
+    print "Failure!: %s is %s; expected %s" % (what, value, expected)
+    raise StandardError()
+
+
+def make_messages(count, seed=1):
+  "Return a corpus.Corpus of count made-up messages."
+  rand = random.Random(seed)
+  hosts = ['host%i.example.com' % number for number in range(30)]
+  messages = corpus.Corpus()
+  for number in range(count):
+    items = [(':path', '/%x' % rand.randint(0, 1 << rand.randint(4, 40))),
+             ('user-agent', 'Mozilla/5.0 Firefox/%i.0' % rand.randint(1, 3))]
+    if rand.random() < 0.5:
+      items.append(('cookie', 'a=%i' % number * rand.randint(1, 60)))
+    messages.add(corpus.MSG_TYPES[number % 2], items,
+                 rand.choice(hosts[:rand.randint(1, len(hosts))]))
+  return messages
+
+
+def results_for(message_type, items):
+  """
+  Return results like process_message()'s for a message, from a baseline
+  and a codec that compresses each message on its own.
+  """
+  text = ''.join(['%s: %s\r\n' % item for item in items])
+  return {'_message_type': message_type,
+          'http1': {'size': len(text)},
+          'zlib': {'size': len(zlib.compress(text))}}
+
+
+def estimate(messages, fraction, seed):
+  "Return the sample and its estimated ratio for zlib, for requests."
+  sample = StratifiedSample(fraction, seed)
+  for message_type, items, _ in sample.select(messages):
+    sample.add(results_for(message_type, items), 'http1')
+  return sample, sample.interval('req', 'zlib')
+
+
+def main():
+  messages = make_messages(4000)
+  base = size = 0
+  for message_type, message, _ in messages:
+    if message_type == 'req':
+      results = results_for(message_type, message.items())
+      base += results['http1']['size']
+      size += results['zlib']['size']
+  full_ratio = float(size) / base
+
+  sample, (ratio, half_width) = estimate(messages, 1, 0)
+  Check("ratio of the whole corpus", ratio, full_ratio, 1e-12)
+  Check("interval of the whole corpus", half_width, 0, 1e-12)
+  Check("messages", sample.summary('req')[0], 2000, 0)
+  Check("messages sampled", sample.summary('req')[1], 2000, 0)
+
+  # a stateless codec's estimate is unbiased, and its 95% confidence
+  # interval holds the whole corpus's ratio for about 95% of samples
+  covered = 0
+  errors = []
+  for seed in range(40):
+    sample, (ratio, half_width) = estimate(messages, 0.1, seed)
+    total, sampled, strata = sample.summary('req')
+    Check("messages", total, 2000, 0)
+    Check("messages sampled", sampled, 200, strata)
+    Check("interval", half_width, 0.01, 0.01)
+    covered += abs(ratio - full_ratio) <= half_width
+    errors.append(ratio - full_ratio)
+  Check("intervals holding the ratio", covered, 38, 3)
+  Check("mean error", sum(errors) / len(errors), 0, 0.002)
+
+  # only exact duplicates (of type, host and headers, in order) are dropped
+  dedup = Deduplicator()
+  unique = list(dedup.unique([
+    ('req', [('a', '1'), ('b', '2')], 'x'),
+    ('req', [('a', '1'), ('b', '2')], 'y'),
+    ('res', [('a', '1'), ('b', '2')], 'x'),
+    ('req', [('b', '2'), ('a', '1')], 'x'),
+    ('req', [['a', '1'], ['b', '2']], 'x'),
+    ('req', [('a', '1'), ('b', '2')], 'y'),
+  ]))
+  Check("unique messages", len(unique), 4, 0)
+  Check("duplicates", dedup.duplicates, 2, 0)
+
+  print "Success!"
+
+
+main()
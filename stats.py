@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+"""
+Timing and online statistics helpers for compare_compressors.py.
+"""
+
+# pylint: disable=W0311
+
+import ctypes
+import ctypes.util
+import errno
+import math
+import os
+import sys
+import time
+import timeit
+
+# clock_gettime() ids of the monotonic clock, by platform
+MONOTONIC_CLOCKS = {'linux': 1, 'darwin': 6}
+
+CPU_SETSIZE = 1024  # CPUs in a cpu_set_t
+WORD_BITS = 8 * ctypes.sizeof(ctypes.c_ulong)  # CPUs per word of one
+CpuSet = ctypes.c_ulong * (CPU_SETSIZE // WORD_BITS)
+
+
+class Timespec(ctypes.Structure):
+  "A struct timespec, for clock_gettime()."
+  _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def c_function(name, restype, *argtypes):
+  """
+  Return the C library function name, called with argtypes and returning
+  restype, or None if it can't be found.
+  """
+  for library in ['c', 'rt']:
+    path = ctypes.util.find_library(library)
+    library = path and ctypes.CDLL(path, use_errno=True)
+    if library and hasattr(library, name):
+      return ctypes.CFUNCTYPE(restype, *argtypes, use_errno=True)(
+        (name, library))
+  return None
+
+
+def monotonic_clock():
+  """
+  Return a function that reads the monotonic clock in (nanosecond
+  resolution) seconds, or None if there isn't one to hand.
+  """
+  if hasattr(time, 'monotonic'):
+    return time.perf_counter
+  clock_id = MONOTONIC_CLOCKS.get(sys.platform.rstrip('0123456789'))
+  # a raw address is the cheapest argument for ctypes to pass
+  clock_gettime = clock_id is not None and c_function(
+    'clock_gettime', ctypes.c_int, ctypes.c_int, ctypes.c_void_p)
+  if not clock_gettime:
+    return None
+  now = Timespec()
+  address = ctypes.addressof(now)
+  def read():
+    "Return the monotonic clock's time, in seconds."
+    if clock_gettime(clock_id, address):
+      raise OSError(ctypes.get_errno(), "clock_gettime failed")
+    return now.tv_sec + now.tv_nsec * 1e-9
+  return read
+
+
+def cpu_affinity():
+  """
+  Return the sorted list of CPUs this process may run on, or None if the
+  platform doesn't say.
+  """
+  if hasattr(os, 'sched_getaffinity'):
+    return sorted(os.sched_getaffinity(0))
+  sched_getaffinity = c_function('sched_getaffinity', ctypes.c_int,
+                                 ctypes.c_int, ctypes.c_size_t,
+                                 ctypes.c_void_p)
+  if not sched_getaffinity:
+    return None
+  cpu_set = CpuSet()
+  if sched_getaffinity(0, ctypes.sizeof(cpu_set), ctypes.addressof(cpu_set)):
+    raise OSError(ctypes.get_errno(), "sched_getaffinity failed")
+  return [cpu for cpu in range(CPU_SETSIZE)
+          if cpu_set[cpu // WORD_BITS] & (1 << cpu % WORD_BITS)]
+
+
+def pin_to_cpu(cpu):
+  """
+  Pin this process (and so, the child processes it starts) to one CPU.
+  Raises OSError if it can't.
+  """
+  if hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(0, [cpu])
+    return
+  sched_setaffinity = c_function('sched_setaffinity', ctypes.c_int,
+                                 ctypes.c_int, ctypes.c_size_t,
+                                 ctypes.c_void_p)
+  if not sched_setaffinity:
+    raise OSError(errno.ENOSYS, "can't set CPU affinity here")
+  if not 0 <= cpu < CPU_SETSIZE:
+    raise OSError(errno.EINVAL, "no CPU %i" % cpu)
+  cpu_set = CpuSet()
+  cpu_set[cpu // WORD_BITS] = 1 << cpu % WORD_BITS
+  if sched_setaffinity(0, ctypes.sizeof(cpu_set), ctypes.addressof(cpu_set)):
+    raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+# time.time() (Python 2's default timer) goes back when the system clock is
+# set, and is only good to a microsecond or so
+wall_clock = monotonic_clock() or timeit.default_timer
+cpu_clock = getattr(time, 'process_time', time.clock)
+
+
+def timed(func, *args):
+  """
+  Call func(*args), and return (result, wall seconds, CPU seconds).
+  """
+  start_wall, start_cpu = wall_clock(), cpu_clock()
+  result = func(*args)
+  return result, wall_clock() - start_wall, cpu_clock() - start_cpu
+
+
+class QuantileSketch(object):
+  """
+  Approximate quantiles of a stream of non-negative numbers, in memory
+  proportional to the logarithm of their range rather than their count.
+
+  Values are counted in logarithmically sized buckets, so any quantile is
+  returned within 'accuracy' of its true (relative) value. Sketches with
+  the same accuracy can be merged.
+  """
+  def __init__(self, accuracy=0.01, min_value=1e-9):
+    self.accuracy = accuracy
+    self.min_value = min_value
+    self.gamma = (1 + accuracy) / (1 - accuracy)
+    self.log_gamma = math.log(self.gamma)
+    self.buckets = {}
+    self.zeros = 0  # values too small to bucket
+    self.count = 0
+
+  def add(self, value):
+    "Add a value to the sketch."
+    self.count += 1
+    if value < self.min_value:
+      self.zeros += 1
+      return
+    index = int(math.ceil(math.log(value) / self.log_gamma))
+    self.buckets[index] = self.buckets.get(index, 0) + 1
+
+  def merge(self, other):
+    "Add the contents of another sketch to this one."
+    assert self.gamma == other.gamma, "sketch accuracies differ"
+    self.count += other.count
+    self.zeros += other.zeros
+    for index, count in other.buckets.items():
+      self.buckets[index] = self.buckets.get(index, 0) + count
+
+  def quantile(self, fraction):
+    """
+    Return the approximate value below which 'fraction' (0-1) of the values
+    fall, or 0 if nothing has been added.
+    """
+    if self.count == 0:
+      return 0
+    rank = fraction * (self.count - 1)
+    seen = self.zeros
+    if rank < seen:
+      return 0
+    for index in sorted(self.buckets.keys()):
+      seen += self.buckets[index]
+      if rank < seen:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+    return 2 * self.gamma ** max(self.buckets.keys()) / (self.gamma + 1)
+
+
+class RunningStats(object):
+  """
+  Count, mean, variance, extremes and approximate quantiles of a stream of
+  numbers, kept in constant memory.
+
+  The mean and variance are updated with Welford's method; statistics from
+  separate streams (e.g., shards of a run) are combined with Chan et al.'s
+  pairwise formula by merge().
+  """
+  def __init__(self, accuracy=0.01):
+    self.count = 0
+    self.mean = 0.0
+    self.m2 = 0.0  # sum of squared differences from the mean
+    self.min = None
+    self.max = None
+    self.sketch = QuantileSketch(accuracy)
+
+  def add(self, value):
+    "Add a value to the statistics."
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (value - self.mean)
+    if self.min is None or value < self.min:
+      self.min = value
+    if self.max is None or value > self.max:
+      self.max = value
+    self.sketch.add(value)
+
+  def merge(self, other):
+    "Add the statistics of another stream to these."
+    if not other.count:
+      return
+    count = self.count + other.count
+    delta = other.mean - self.mean
+    self.mean += delta * other.count / count
+    self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+    self.count = count
+    if self.min is None or other.min < self.min:
+      self.min = other.min
+    if self.max is None or other.max > self.max:
+      self.max = other.max
+    self.sketch.merge(other.sketch)
+
+  def variance(self):
+    "Return the sample variance, or 0 if there are fewer than two values."
+    if self.count < 2:
+      return 0.0
+    return self.m2 / (self.count - 1)
+
+  def std(self):
+    "Return the sample standard deviation."
+    return math.sqrt(self.variance())
+
+  def quantile(self, fraction):
+    "Return the approximate 'fraction' (0-1) quantile."
+    return self.sketch.quantile(fraction)
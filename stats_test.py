@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+# pylint: disable=W0311
+
+import math
+import random
+
+from stats import QuantileSketch, RunningStats
+
+
+def Check(what, value, expected, tolerance):
+  if abs(value - expected) > tolerance:
+    print "Failure!: %s is %s; expected %s" % (what, value, expected)
+    raise StandardError()
+
+
+def main():
+  rand = random.Random(1)
+  values = [rand.lognormvariate(-1, 0.5) for _ in range(20000)]
+  mean = sum(values) / len(values)
+  std = math.sqrt(sum([(v - mean) ** 2 for v in values]) / (len(values) - 1))
+  ordered = sorted(values)
+
+  # a single stream
+  whole = RunningStats()
+  for value in values:
+    whole.add(value)
+  Check("mean", whole.mean, mean, 1e-9)
+  Check("std", whole.std(), std, 1e-9)
+  Check("min", whole.min, ordered[0], 0)
+  Check("max", whole.max, ordered[-1], 0)
+  for fraction in [0.5, 0.9, 0.99]:
+    exact = ordered[int(fraction * (len(values) - 1))]
+    Check("p%d" % (fraction * 100), whole.quantile(fraction), exact,
+          exact * 0.01)
+
+  # merged shards must agree with the single stream
+  merged = RunningStats()
+  for start in range(0, len(values), 3000):
+    shard = RunningStats()
+    for value in values[start:start + 3000]:
+      shard.add(value)
+    merged.merge(shard)
+  Check("merged count", merged.count, whole.count, 0)
+  Check("merged mean", merged.mean, whole.mean, 1e-9)
+  Check("merged std", merged.std(), whole.std(), 1e-9)
+  for fraction in [0.5, 0.9, 0.99]:
+    Check("merged p%d" % (fraction * 100), merged.quantile(fraction),
+          whole.quantile(fraction), 0)
+
+  # zeros and empty sketches
+  sketch = QuantileSketch()
+  Check("empty", sketch.quantile(0.5), 0, 0)
+  for value in [0, 0, 0, 1]:
+    sketch.add(value)
+  Check("zero median", sketch.quantile(0.5), 0, 0)
+  Check("max", sketch.quantile(1), 1, 0.01)
+  print "Success!"
+
+
+main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+"""
+Synthetic header corpora, for testing codecs on more traffic than we have
+captures of.
+
+A HeaderModel learns from HAR or corpus files how many requests a session
+(one file) makes, how it moves between hosts, which headers each host's
+messages have, in what order, and their values. It then generates as
+many messages as wanted, as sessions drawn from what it learned.
+
+Run as a script, this writes a synthetic corpus file:
+
+  ./synthetic.py -n 100000000 -o big.hdrc *.har
+"""
+
+# pylint: disable=W0311
+
+from collections import defaultdict
+import optparse
+import random
+import string
+import sys
+
+import corpus
+import harfile
+
+# header names whose values are never made up
+FIXED_NAMES = frozenset([':host', 'host'])
+
+# characters that made-up values draw from, by the character they replace
+CHAR_CLASSES = {}
+for chars in [string.digits, string.ascii_lowercase, string.ascii_uppercase]:
+  for char in chars:
+    CHAR_CLASSES[char] = chars
+
+STAY, REVISIT, NEW = range(3)  # ways to pick the host of the next request
+
+
+class HeaderModel(object):
+  """
+  What header messages look like in some sessions, learned by learn() and
+  used by generate().
+
+  Messages are modelled per host: a message's header names (in order) are
+  those of a message of the same type to the same host, and each value is
+  either the one last sent for that name to the host in the session, one
+  seen for it with the host, or (as often as values seen only once occur)
+  a new one made by changing the end of one seen.
+  """
+  def __init__(self):
+    self.sessions = []  # number of requests in each session
+    self.hosts = []  # host of each first request to a host in a session
+    self.moves = [0, 0, 0]  # STAY, REVISIT, NEW -> count
+    self.templates = defaultdict(list)  # (type, host) -> [names, ...]
+    self.values = defaultdict(list)  # (type, host, name) -> [value, ...]
+    self.repeats = defaultdict(int)  # (type, host, name) -> count
+    self.chances = defaultdict(int)  # (type, host, name) -> count
+    self.novelty = {}  # (type, name) -> fraction of values seen once
+    self.interned = {}
+
+  def intern(self, value):
+    "Return a shared copy of value, to save memory."
+    return self.interned.setdefault(value, value)
+
+  def learn(self, messages):
+    """
+    Learn from a session's (message_type, header items, host) tuples, as
+    generated by corpus.iter_items() for a file.
+    """
+    intern = self.intern
+    requests = 0
+    visited = []
+    last = {}  # (type, host, name) -> value last sent in this session
+    for message_type, items, host in messages:
+      host = intern(host)
+      if message_type == 'req':
+        requests += 1
+        if visited and host == visited[-1]:
+          self.moves[STAY] += 1
+        elif host in visited:
+          self.moves[REVISIT] += 1
+          visited.remove(host)
+        else:
+          self.moves[NEW] += 1
+          self.hosts.append(host)
+        visited.append(host)
+      self.templates[(message_type, host)].append(
+        intern(tuple([intern(name) for name, _ in items])))
+      for name, value in items:
+        key = (message_type, host, intern(name))
+        value = intern(value)
+        if key in last:
+          self.chances[key] += 1
+          if last[key] == value:
+            self.repeats[key] += 1
+        last[key] = value
+        self.values[key].append(value)
+    if requests:
+      self.sessions.append(requests)
+    self.novelty = {}
+
+  def learn_files(self, filenames, read_jobs=1, read_items=None):
+    """
+    Learn from each HAR or corpus file as a session, reading them with
+    corpus.iter_files().
+    """
+    for _, messages in corpus.iter_files(
+        filenames, read_jobs, read_items or harfile.iter_input_items):
+      self.learn(messages)
+    self.interned.clear()
+    if not self.sessions:
+      raise ValueError("no messages to learn from")
+
+  def freeze(self):
+    "Work out the novelty of values, after learning."
+    seen = defaultdict(lambda: defaultdict(int))  # (type, name) -> v -> n
+    for (message_type, _, name), values in self.values.items():
+      for value in values:
+        seen[(message_type, name)][value] += 1
+    for key, counts in seen.items():
+      if key[1] in FIXED_NAMES:
+        self.novelty[key] = 0.0
+        continue
+      once = len([count for count in counts.values() if count == 1])
+      self.novelty[key] = float(once) / sum(counts.values())
+
+  def generate(self, count, seed=0):
+    """
+    Generate count (message_type, header items, host) tuples, in sessions
+    of requests, each followed by its response. The same seed generates
+    the same messages.
+    """
+    if not self.novelty:
+      self.freeze()
+    rng = random.Random(seed)
+    moves = [(move, weight) for move, weight in enumerate(self.moves)]
+    emitted = 0
+    while emitted < count:
+      visited = []
+      last = {}
+      for _ in xrange(rng.choice(self.sessions)):
+        host = self.next_host(rng, visited, moves)
+        for message_type in corpus.MSG_TYPES:
+          if emitted == count:
+            return
+          yield (message_type, self.message(rng, message_type, host, last),
+                 host)
+          emitted += 1
+
+  def next_host(self, rng, visited, moves):
+    "Pick the host of the next request in a session, and visit it."
+    move = NEW
+    if len(visited) > 1:
+      move = weighted_choice(rng, moves)
+    elif visited:
+      move = weighted_choice(rng, [moves[STAY], moves[NEW]])
+    if move == STAY:
+      return visited[-1]
+    if move == REVISIT:
+      host = visited.pop(rng.randrange(len(visited) - 1))
+    else:
+      host = rng.choice(self.hosts)
+      if host in visited:
+        visited.remove(host)
+    visited.append(host)
+    return host
+
+  def message(self, rng, message_type, host, last):
+    "Make the header items of a message of message_type to host."
+    items = []
+    for name in rng.choice(self.templates[(message_type, host)]):
+      key = (message_type, host, name)
+      if key in last and \
+          rng.random() * self.chances[key] < self.repeats[key]:
+        value = last[key]
+      elif rng.random() < self.novelty[(message_type, name)]:
+        value = made_up(rng, rng.choice(self.values[key]))
+      else:
+        value = rng.choice(self.values[key])
+      last[key] = value
+      items.append((name, value))
+    return items
+
+
+def weighted_choice(rng, choices):
+  "Return the choice from a list of (choice, weight), by weight."
+  total = sum([weight for _, weight in choices])
+  point = rng.random() * total
+  for choice, weight in choices:
+    point -= weight
+    if point < 0:
+      return choice
+  return choices[-1][0]
+
+
+def made_up(rng, value):
+  """
+  Return a new value like value, with letters and digits in (at most) its
+  second half replaced by random ones of the same kind.
+  """
+  if not value:
+    return value
+  start = rng.randrange(len(value) // 2, len(value))
+  return value[:start] + ''.join([
+    char in CHAR_CLASSES and rng.choice(CHAR_CLASSES[char]) or char
+    for char in value[start:]])
+
+
+def main():
+  "Write a synthetic corpus file."
+  optp = optparse.OptionParser(
+    usage="%prog [options] -n COUNT -o CORPUS_FILE har-or-corpus-files")
+  optp.add_option('-n', '--messages',
+                  type='int',
+                  dest='messages',
+                  help='number of messages to generate',
+                  metavar='COUNT')
+  optp.add_option('-o', '--output',
+                  dest='output',
+                  help='corpus file to write',
+                  metavar='FILE')
+  optp.add_option('--seed',
+                  type='int',
+                  dest='seed',
+                  help='random seed (default: %default)',
+                  default=0)
+  optp.add_option('-j', '--jobs',
+                  type='int',
+                  dest='jobs',
+                  help='parse HAR files in this many worker processes '
+                  '(default: %default)',
+                  default=1,
+                  metavar='N')
+  options, args = optp.parse_args()
+  if not options.output or not options.messages or not args:
+    optp.error("need a message count, an output file and some input files")
+  model = HeaderModel()
+  try:
+    model.learn_files(harfile.expand_paths(args), options.jobs)
+  except ValueError as oops:
+    optp.error(str(oops))
+  writer = corpus.CorpusWriter(options.output)
+  for message_type, items, host in model.generate(options.messages,
+                                                  options.seed):
+    writer.add(message_type, items, host)
+  writer.close()
+  sys.stderr.write("Wrote %i messages (%i strings) to %s.\n" % (
+    len(writer), writer.num_strings, options.output))
+
+
+if __name__ == "__main__":
+  main()